@@ -0,0 +1,78 @@
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from repositories.products import FirestoreProductRepository, ProductRepository
+
+# Compara los backends del catálogo con el mismo set de operaciones.
+# Uso:
+#   python -m benchmarks.bench_catalog_repository --backends sql
+#   FIRESTORE_EMULATOR_HOST=localhost:8080 python -m benchmarks.bench_catalog_repository --backends sql,firestore
+
+
+def _build_repository(backend: str, database_url: str) -> ProductRepository:
+    if backend == "sql":
+        from repositories.sql_products import SqlProductRepository
+        return SqlProductRepository(database_url)
+    from tools.firebase_client import get_db
+    return FirestoreProductRepository(get_db(), collection='bench_products')
+
+
+async def _timed(label: str, iterations: int, fn) -> dict:
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "op": label,
+        "p50_ms": statistics.median(samples),
+        "p95_ms": statistics.quantiles(samples, n=20, method="inclusive")[-1] if len(samples) > 1 else samples[0],
+        "mean_ms": statistics.fmean(samples),
+    }
+
+
+async def _seed(repository: ProductRepository, products: int) -> list:
+    return await repository.upsert_products([
+        {"name": f"Producto {i:06d}", "price": float(random.randint(1000, 50000)), "stock": 10**9,
+         "description": f"Descripción del producto {i}"}
+        for i in range(products)
+    ])
+
+
+async def run_backend(backend: str, products: int, iterations: int, cart_size: int, database_url: str) -> list:
+    repository = _build_repository(backend, database_url)
+    await repository.init()
+    try:
+        ids = await _seed(repository, products)
+        return [
+            await _timed("list_products", max(1, iterations // 10), repository.list_products),
+            await _timed("get_product", iterations, lambda: repository.get_product(random.choice(ids))),
+            await _timed(f"get_products[{cart_size}]", iterations, lambda: repository.get_products(random.sample(ids, cart_size))),
+            await _timed(f"decrement_stock[{cart_size}]", iterations,
+                         lambda: repository.decrement_stock({pid: 1 for pid in random.sample(ids, cart_size)})),
+            await _timed(f"restore_stock[{cart_size}]", iterations,
+                         lambda: repository.restore_stock({pid: 1 for pid in random.sample(ids, cart_size)})),
+        ]
+    finally:
+        await repository.close()
+
+
+async def main(args):
+    print(f"{'backend':<10} {'operación':<22} {'p50 ms':>9} {'p95 ms':>9} {'media ms':>9}")
+    for backend in args.backends.split(","):
+        for row in await run_backend(backend.strip(), args.products, args.iterations, args.cart_size, args.database_url):
+            print(f"{backend:<10} {row['op']:<22} {row['p50_ms']:>9.3f} {row['p95_ms']:>9.3f} {row['mean_ms']:>9.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark de los repositorios del catálogo.")
+    parser.add_argument("--backends", default="sql", help="Lista separada por comas: sql,firestore")
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--cart-size", type=int, default=5)
+    parser.add_argument("--database-url", default="sqlite+aiosqlite:///:memory:")
+    asyncio.run(main(parser.parse_args()))
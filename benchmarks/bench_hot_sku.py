@@ -0,0 +1,58 @@
+import argparse
+import threading
+import time
+import uuid
+
+from services.stock_reservations import _reserve, enable_sharding
+from tools.firebase_client import get_db
+
+# Prueba de carga sobre un único SKU contra el emulador local de Firestore.
+# Uso:
+#   FIRESTORE_EMULATOR_HOST=localhost:8080 python -m benchmarks.bench_hot_sku --shards 0,10 --workers 32
+
+
+def run(db, product_id: str, shards: int, workers: int, duration: float) -> dict:
+    db.collection('products').document(product_id).set({'name': 'SKU de prueba', 'price': 1000, 'stock': 10**7, 'stockShards': 0})
+    enable_sharding(db, product_id, shards)
+
+    counters = {"ok": 0, "failed": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        while time.perf_counter() < deadline:
+            try:
+                _reserve(db, f"bench-{uuid.uuid4().hex}", [{"id": product_id, "quantity": 1}], ttl_seconds=60)
+                key = "ok"
+            except Exception:
+                key = "failed"
+            with lock:
+                counters[key] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return {"shards": shards, "ok": counters["ok"], "failed": counters["failed"], "per_second": counters["ok"] / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput de reservas sobre un SKU caliente.")
+    parser.add_argument("--shards", default="0,10", help="Cantidades de shards a comparar (0 = sin shards)")
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--product-id", default="bench-hot-sku")
+    args = parser.parse_args()
+
+    db = get_db()
+    print(f"{'shards':>6} {'ok':>8} {'fallidas':>9} {'reservas/s':>11}")
+    for shards in (int(x) for x in args.shards.split(",")):
+        row = run(db, args.product_id, shards, args.workers, args.duration)
+        print(f"{row['shards']:>6} {row['ok']:>8} {row['failed']:>9} {row['per_second']:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
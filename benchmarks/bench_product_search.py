@@ -0,0 +1,70 @@
+import argparse
+import random
+import statistics
+import time
+
+from services.product_search import ProductSearchIndex
+
+# Latencia del índice de búsqueda sobre un catálogo sintético.
+# Uso:
+#   python -m benchmarks.bench_product_search --products 100000
+
+NOUNS = ["polera", "zapatilla", "chaqueta", "mochila", "cuaderno", "lámpara", "cañón", "audífonos",
+         "teclado", "cafetera", "sartén", "almohada", "bicicleta", "pelota", "reloj", "botella"]
+ADJECTIVES = ["eléctrico", "térmica", "deportiva", "clásico", "ergonómico", "inalámbrico", "orgánico",
+              "compacta", "premium", "económico", "resistente", "plegable"]
+BRANDS = ["andes", "pacífico", "atacama", "maule", "biobío", "araucanía", "patagonia", "chiloé"]
+QUERIES = ["polera", "zapatilla deportiva", "canon", "audifonos inal", "cafetera electrica premium",
+           "patagonia mochila", "reloj", "bicicleta plegable", "teclado ergo", "sarten"]
+
+
+def synthetic_catalog(size: int):
+    rng = random.Random(42)
+    for i in range(size):
+        name = f"{rng.choice(NOUNS).capitalize()} {rng.choice(ADJECTIVES)} {rng.choice(BRANDS).capitalize()} {i}"
+        yield {
+            "id": f"p{i}",
+            "name": name,
+            "description": f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} de la línea {rng.choice(BRANDS)}",
+            "price": rng.randint(990, 150000),
+            "category": rng.choice(NOUNS),
+        }
+
+
+def _p95(samples):
+    return statistics.quantiles(samples, n=20, method="inclusive")[-1] if len(samples) > 1 else samples[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del índice de búsqueda de productos.")
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    index = ProductSearchIndex()
+    start = time.perf_counter()
+    index.build(synthetic_catalog(args.products))
+    print(f"Índice construido con {len(index)} productos en {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    index.upsert({"id": "p1", "name": "Polera térmica Andes edición especial", "price": 19990, "category": "polera"})
+    print(f"Actualización incremental: {(time.perf_counter() - start) * 1e6:.0f}µs")
+
+    print(f"{'consulta':<30} {'resultados':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for query in QUERIES + ["patagonia mochila|category=mochila|max_price=20000"]:
+        text, *filters = query.split("|")
+        kwargs = {}
+        for f in filters:
+            key, value = f.split("=")
+            kwargs[key] = float(value) if key.endswith("price") else value
+        samples = []
+        for _ in range(args.iterations):
+            t0 = time.perf_counter()
+            result = index.search(text, **kwargs)
+            samples.append((time.perf_counter() - t0) * 1000)
+        samples.sort()
+        print(f"{query[:30]:<30} {result['total']:>10} {statistics.median(samples):>8.3f} {_p95(samples):>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import random
+import statistics
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from services.shipping_rates import QUOTE_SAMPLES_COLLECTION, RateTable
+
+# Precisión y latencia de la tabla local de tarifas frente a cotizaciones reales.
+# Cada punto registrado se quita de la tabla y se estima con el resto (leave-one-out),
+# así el error medido es el que vería un carrito con un peso nunca cotizado.
+# Uso:
+#   python -m benchmarks.bench_rate_estimates --from-firestore
+#   python -m benchmarks.bench_rate_estimates --lanes 300
+
+
+def synthetic_samples(lanes: int, weights_per_lane: int):
+    # Tarifas escalonadas por kilo con un recargo por zona, parecidas a las de Chilexpress.
+    rng = random.Random(7)
+    services = [(3, "EXPRESS", 1.6), (4, "EXTENDIDO", 1.0), (5, "PRIORITARIO", 2.1)]
+    for lane in range(lanes):
+        base = rng.randint(2500, 6000)
+        per_kg = rng.randint(400, 1500)
+        weights = sorted(rng.sample([0.5, 1, 1.5, 2, 3, 4, 5, 6, 8, 10, 12, 15, 20, 25, 30], weights_per_lane))
+        for code, description, factor in services:
+            for weight in weights:
+                yield {
+                    "origin": "STGO",
+                    "destination": f"C{lane}",
+                    "serviceTypeCode": code,
+                    "serviceDescription": description,
+                    "weight": float(weight),
+                    "price": round((base + per_kg * np.ceil(weight)) * factor),
+                }
+
+
+def leave_one_out(samples):
+    by_series = defaultdict(list)
+    for sample in samples:
+        by_series[(sample["origin"], sample["destination"], int(sample["serviceTypeCode"]))].append(sample)
+
+    errors, latencies = [], []
+    for (origin, destination, code), series in by_series.items():
+        if len(series) < 3:
+            continue
+        for held_out in series:
+            table = RateTable.build(s for s in series if s is not held_out)
+            t0 = time.perf_counter()
+            codes, prices = table.estimate_prices(origin, destination, [held_out["weight"]])
+            latencies.append((time.perf_counter() - t0) * 1e6)
+            estimate = prices[list(codes).index(code), 0]
+            errors.append(abs(estimate - held_out["price"]) / held_out["price"])
+    return np.array(errors), latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precisión de la tabla local de tarifas de envío.")
+    parser.add_argument("--from-firestore", action="store_true", help=f"Usa las muestras de '{QUOTE_SAMPLES_COLLECTION}'")
+    parser.add_argument("--lanes", type=int, default=200)
+    parser.add_argument("--weights-per-lane", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.from_firestore:
+        from tools.firebase_client import get_db
+        samples = [doc.to_dict() for doc in get_db().collection(QUOTE_SAMPLES_COLLECTION).stream()]
+    else:
+        samples = list(synthetic_samples(args.lanes, args.weights_per_lane))
+
+    start = time.perf_counter()
+    table = RateTable.build(samples)
+    print(f"Tabla construida con {table.samples} muestras y {len(table)} carriles en {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    errors, latencies = leave_one_out(samples)
+    if not len(errors):
+        print("No hay series con al menos 3 pesos cotizados.")
+        return
+    latencies.sort()
+    print(f"Puntos evaluados: {len(errors)}")
+    print(f"Error relativo  p50 {np.percentile(errors, 50):.1%}  p90 {np.percentile(errors, 90):.1%}  "
+          f"máx {errors.max():.1%}  dentro de ±10%: {(errors <= 0.10).mean():.1%}")
+    print(f"Latencia estimación  p50 {statistics.median(latencies):.1f}µs  p95 {statistics.quantiles(latencies, n=20, method='inclusive')[-1]:.1f}µs")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 from transbank.webpay.webpay_plus.transaction import Transaction
 from transbank.common.integration_type import IntegrationType
@@ -7,6 +8,7 @@ from firebase_admin import firestore
 from pydantic import BaseModel
 from typing import List, Dict, Any
 from services.chilexpress_api import ChilexpressApiService
+from services.profiling import span
 
 
 class OrderItem(BaseModel):
@@ -47,7 +49,8 @@ async def init_tbk_transaction(data: dict):
     return_url = data['return_url']
 
     try:
-        resp = tbk_transaction.create(buy_order, session_id, amount, return_url)
+        with span("transbank.create"):
+            resp = await asyncio.to_thread(tbk_transaction.create, buy_order, session_id, amount, return_url)
 
         if isinstance(resp, dict):
             if 'error_message' in resp:
@@ -62,9 +65,36 @@ async def init_tbk_transaction(data: dict):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _tbk_response_to_dict(tbk_response) -> Dict[str, Any]:
+    if isinstance(tbk_response, dict):
+        return tbk_response
+    return {
+        "vci": tbk_response.vci,
+        "amount": tbk_response.amount,
+        "status": tbk_response.status,
+        "buy_order": tbk_response.buy_order,
+        "session_id": tbk_response.session_id,
+        "card_detail": tbk_response.card_detail,
+        "accounting_date": tbk_response.accounting_date,
+        "transaction_date": str(tbk_response.transaction_date),
+        "authorization_code": tbk_response.authorization_code,
+        "payment_type_code": tbk_response.payment_type_code,
+        "response_code": tbk_response.response_code,
+        "installments_amount": tbk_response.installments_amount,
+        "installments_number": tbk_response.installments_number,
+        "balance": tbk_response.balance
+    }
+
+
+async def status_tbk_transaction(token: str) -> Dict[str, Any]:
+    with span("transbank.status"):
+        return _tbk_response_to_dict(await asyncio.to_thread(tbk_transaction.status, token))
+
+
 async def commit_tbk_transaction(token: str):
     try:
-        tbk_response = tbk_transaction.commit(token)
+        with span("transbank.commit"):
+            tbk_response = await asyncio.to_thread(tbk_transaction.commit, token)
         is_dict = isinstance(tbk_response, dict)
         response_code = tbk_response['response_code'] if is_dict else tbk_response.response_code
         status = tbk_response['status'] if is_dict else tbk_response.status
@@ -72,25 +102,7 @@ async def commit_tbk_transaction(token: str):
         if response_code != 0:
             return {"response_code": response_code, "status": status, "message": "Pago rechazado."}
         else:
-            if is_dict:
-                return tbk_response
-            else:
-                return {
-                    "vci": tbk_response.vci,
-                    "amount": tbk_response.amount,
-                    "status": tbk_response.status,
-                    "buy_order": tbk_response.buy_order,
-                    "session_id": tbk_response.session_id,
-                    "card_detail": tbk_response.card_detail,
-                    "accounting_date": tbk_response.accounting_date,
-                    "transaction_date": str(tbk_response.transaction_date),
-                    "authorization_code": tbk_response.authorization_code,
-                    "payment_type_code": tbk_response.payment_type_code,
-                    "response_code": tbk_response.response_code,
-                    "installments_amount": tbk_response.installments_amount,
-                    "installments_number": tbk_response.installments_number,
-                    "balance": tbk_response.balance
-                }
+            return _tbk_response_to_dict(tbk_response)
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -1,18 +1,33 @@
 import os
 import json
+import asyncio
 from fastapi import FastAPI, HTTPException
 import httpx
 from firebase_admin import credentials, initialize_app, firestore
 import firebase_admin
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
-from routers import users, products, chilexpress
-from init_transaction import init_tbk_transaction, commit_tbk_transaction
+from routers import users, products, chilexpress, analytics, profiling, cart
+from repositories.products import create_product_repository
+from services.shared_cache import create_shared_cache
+from services.profiling import RequestProfiler, ProfilingMiddleware
+from services.stock_reservations import reserve_stock, release_reservation, run_reservation_sweeper
+from services.product_search import ProductSearchIndex
+from services.tbk_reconciler import TbkReconciler
+from services.shipping_labels import create_label_store
+from services.shipping_rates import ShippingQuoter
+from services.chilexpress_api import ChilexpressApiService
+from services.order_events import OrderEventHub
+from services.sales_analytics import run_analytics_outbox
+from init_transaction import init_tbk_transaction
+from services.cart_pricing import price_cart
 from typing import List, Dict, Any
 
 load_dotenv()
 
 app = FastAPI()
+request_profiler = RequestProfiler.from_env()
+app.add_middleware(ProfilingMiddleware, profiler=request_profiler)
 
 origins = [
     'http://localhost:5173',
@@ -98,10 +113,65 @@ except Exception as e:
     raise Exception(f"Fallo al inicializar Firebase Admin SDK: {e}")
 
 db = firestore.client()
+product_repository = create_product_repository(db)
+shared_cache = create_shared_cache()
+search_index = ProductSearchIndex()
+tbk_reconciler = TbkReconciler(db, cache=shared_cache, repository=product_repository)
+label_store = create_label_store()
+order_events = OrderEventHub()
+shipping_quoter = ShippingQuoter(ChilexpressApiService(CHILEXPRESS_CONFIG, cache=shared_cache), db)
+
+background_tasks: List[asyncio.Task] = []
+
+@app.on_event("startup")
+async def startup():
+    await product_repository.init()
+    background_tasks.append(asyncio.create_task(run_reservation_sweeper(db, product_repository)))
+    background_tasks.append(asyncio.create_task(search_index.keep_updated(product_repository)))
+    background_tasks.append(asyncio.create_task(tbk_reconciler.run()))
+    background_tasks.append(asyncio.create_task(shipping_quoter.keep_updated()))
+    background_tasks.append(asyncio.create_task(run_analytics_outbox(db)))
+    order_events.start(db)
+
+@app.on_event("shutdown")
+async def shutdown():
+    for task in background_tasks:
+        task.cancel()
+    search_index.close()
+    order_events.close()
+    await product_repository.close()
 
 @app.post("/api/init-tx")
 async def init_tx(data: dict):
-    return await init_tbk_transaction(data)
+    # Si el frontend envía los ítems, el stock queda retenido mientras dura el pago.
+    items = data.get('items')
+    if items:
+        # El monto que se cobra sale de los precios del servidor, no del enviado por el cliente.
+        try:
+            cart = await price_cart(product_repository, ((item['id'], int(item['quantity'])) for item in items))
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Ítems inválidos.")
+        if not cart.valid:
+            unavailable = [line.id for line in cart.items if not line.available]
+            raise HTTPException(status_code=409, detail=f"Productos no disponibles: {', '.join(unavailable)}")
+        data['amount'] = round(cart.subtotal)
+        try:
+            await reserve_stock(db, data['buy_order'], items, repository=product_repository)
+        except ValueError as ve:
+            raise HTTPException(status_code=409, detail=str(ve))
+    try:
+        resp = await init_tbk_transaction(data)
+    except Exception:
+        if items:
+            await release_reservation(db, data['buy_order'], repository=product_repository)
+        raise
+    try:
+        await tbk_reconciler.record_created(resp['token'], data['buy_order'], data['session_id'], data['amount'])
+    except Exception as e:
+        # Sin registro el pago sigue funcionando: confirm() registra el resultado del commit,
+        # pero el token queda fuera de la reconciliación.
+        print(f"Advertencia: no se pudo registrar el token de Transbank: {e}")
+    return resp
 
 from init_transaction import FinalizeOrderPayload
 from services.chilexpress_api import ChilexpressApiService
@@ -110,14 +180,25 @@ from typing import Dict
 @app.post("/api/confirm-transaction/{token_str}")
 async def confirm_transaction(token_str: str):
     try:
-        resp = await commit_tbk_transaction(token_str)
+        resp = await tbk_reconciler.confirm(token_str)
         return resp
     except Exception as e:
         raise HTTPException(status_code=500, detail=f'Error al confirmar la transaccion: {e}')
 
-app.include_router(users.router(db=db), prefix="")
-app.include_router(products.router(db=db), prefix="")
-app.include_router(chilexpress.router(chilexpress_config=CHILEXPRESS_CONFIG, db=db), prefix="") 
+@app.get("/api/transaction-status/{token_str}")
+async def transaction_status(token_str: str):
+    # Consulta local para el frontend: no llama a Transbank.
+    entry = await tbk_reconciler.lookup(token_str)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Transacción no encontrada.")
+    return entry
+
+app.include_router(users.router(db=db, events=order_events), prefix="")
+app.include_router(products.router(db=db, repository=product_repository, cache=shared_cache, index=search_index), prefix="")
+app.include_router(chilexpress.router(chilexpress_config=CHILEXPRESS_CONFIG, db=db, cache=shared_cache, repository=product_repository, labels=label_store, quoter=shipping_quoter, reconciler=tbk_reconciler), prefix="") 
+app.include_router(analytics.router(db=db), prefix="")
+app.include_router(cart.router(repository=product_repository), prefix="")
+app.include_router(profiling.router(profiler=request_profiler), prefix="")
 
 @app.get("/")
 async def read_root():
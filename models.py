@@ -1,6 +1,6 @@
-from sqlalchemy import Column, Integer, String, LargeBinary, Float, ForeignKey
-from sqlalchemy.orm import declarative_base, relationship
-import base64
+from sqlalchemy import Column, Integer, String, LargeBinary, Float, ForeignKey, DateTime, func, event
+from sqlalchemy.orm import declarative_base, relationship, deferred
+import hashlib
 
 Base = declarative_base()
 
@@ -11,9 +11,11 @@ class Producto(Base):
     precio = Column(Float)
     cantidad = Column(Integer)
     descripcion = Column(String, default='Sin descripción')
-    imagen = Column(LargeBinary, nullable=True)
+    # Diferida: los listados nunca cargan el blob, se sirve en /products/{id}/image.
+    imagen = deferred(Column(LargeBinary, nullable=True))
+    imagen_hash = Column(String(64), nullable=True)
     imagen_url = Column(String, nullable=True)
-    categoria_id = Column(Integer, ForeignKey('categoria.id'))
+    categoria_id = Column(Integer, ForeignKey('categoria.id'), index=True)
 
     categoria = relationship("Categoria", back_populates="productos")
     detalles = relationship('DetalleOrdenCompra', back_populates='producto')
@@ -25,11 +27,31 @@ class Producto(Base):
             "precio": self.precio,
             "cantidad": self.cantidad,
             "descripcion": self.descripcion,
-            "imagen": base64.b64encode(self.imagen).decode('utf-8') if self.imagen else None,
-            "imagen_url": self.imagen_url,
+            "imagen_url": self.imagen_url or product_image_url(self.id, self.imagen_hash),
             "categoria_id": self.categoria_id
         }
 
+def product_image_url(product_id, image_hash: str | None) -> str | None:
+    if not image_hash:
+        return None
+    return f"/products/{product_id}/image?v={image_hash[:16]}"
+
+@event.listens_for(Producto.imagen, 'set')
+def _update_imagen_hash(target, value, oldvalue, initiator):
+    target.imagen_hash = hashlib.sha256(value).hexdigest() if value else None
+
+class Categoria(Base):
+    __tablename__ = "categoria"
+    id = Column(Integer, primary_key=True, index=True)
+    nombre = Column(String, unique=True, index=True)
+    productos = relationship("Producto", back_populates="categoria")
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "nombre": self.nombre
+        }
+
 class Usuario(Base):
     __tablename__ = "usuario"
     id = Column(Integer, primary_key=True, index=True)
@@ -54,4 +76,44 @@ class Transaccion(Base):
     def as_dict(self):
         return {
             'token': self.token
-        }
\ No newline at end of file
+        }
+
+class OrdenCompra(Base):
+    __tablename__ = 'orden_compra'
+    id = Column(Integer, primary_key=True, index=True)
+    usuario_id = Column(Integer, ForeignKey('usuario.id'), index=True)
+    total = Column(Float)
+    fecha = Column(DateTime, server_default=func.now())
+    transaccion_token = Column(String, ForeignKey('transaccion.token'), nullable=True)
+
+    usuario = relationship('Usuario', back_populates='ordenes')
+    detalles = relationship('DetalleOrdenCompra', back_populates='orden')
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "usuario_id": self.usuario_id,
+            "total": self.total,
+            "fecha": self.fecha.isoformat() if self.fecha else None,
+            "transaccion_token": self.transaccion_token
+        }
+
+class DetalleOrdenCompra(Base):
+    __tablename__ = 'detalle_orden_compra'
+    id = Column(Integer, primary_key=True, index=True)
+    orden_id = Column(Integer, ForeignKey('orden_compra.id'), index=True)
+    producto_id = Column(Integer, ForeignKey('producto.id'), index=True)
+    cantidad = Column(Integer)
+    precio_unitario = Column(Float)
+
+    orden = relationship('OrdenCompra', back_populates='detalles')
+    producto = relationship('Producto', back_populates='detalles')
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "orden_id": self.orden_id,
+            "producto_id": self.producto_id,
+            "cantidad": self.cantidad,
+            "precio_unitario": self.precio_unitario
+        }
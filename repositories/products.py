@@ -0,0 +1,205 @@
+import asyncio
+import hashlib
+import os
+import random
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from firebase_admin import firestore
+from models import product_image_url
+from services.profiling import span
+from services.stock_reservations import ROLLUPS_COLLECTION, SHARDS_SUBCOLLECTION, plan_decrement
+
+
+# Campos que devuelve el catálogo. Se piden explícitamente para no descargar 'imagen'
+# (los bytes de la foto) en listados, carrito y búsqueda; la URL sale de imagenHash.
+PRODUCT_FIELDS = ['name', 'price', 'stock', 'description', 'imageUrl', 'imagenHash',
+                  'category', 'categoryId', 'stockShards']
+
+
+class ProductRepository(ABC):
+    # Contrato común del catálogo. Los productos se devuelven con las claves que ya
+    # usa el frontend: id, name, price, stock, description, imageUrl, categoryId.
+    # firestore_stock indica que el stock vive en Firestore: las reservas lo descuentan
+    # en la misma transacción que las registra (con shards). Los demás backends mueven
+    # el stock con decrement_stock/restore_stock y las reservas solo guardan el registro.
+    firestore_stock = False
+
+    async def init(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def list_products(self) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def get_product(self, product_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def get_products(self, product_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def get_product_image(self, product_id: str) -> Optional[Tuple[bytes, str]]:
+        # Devuelve (bytes, sha256 hex) o None si el producto no tiene imagen propia.
+        ...
+
+    @abstractmethod
+    async def decrement_stock(self, quantities: Dict[str, int]):
+        # Todo o nada: ValueError si algún producto no existe o no tiene stock suficiente.
+        ...
+
+    @abstractmethod
+    async def restore_stock(self, quantities: Dict[str, int]):
+        ...
+
+    @abstractmethod
+    async def upsert_products(self, products: List[Dict[str, Any]]) -> List[str]:
+        # Cada producto con 'id' actualiza solo las claves presentes; sin 'id' se crea.
+        ...
+
+
+class FirestoreProductRepository(ProductRepository):
+    firestore_stock = True
+
+    def __init__(self, db: firestore.Client, collection: str = 'products'):
+        self.db = db
+        self.collection = collection
+
+    def to_product(self, doc) -> Dict[str, Any]:
+        product_data = doc.to_dict()
+        product_data['id'] = doc.id
+        product_data.pop('imagen', None)
+        if not product_data.get('imageUrl') and product_data.get('imagenHash'):
+            product_data['imageUrl'] = product_image_url(doc.id, product_data['imagenHash'])
+        return product_data
+
+    def _apply_stock_rollups(self, products: Iterable[Dict[str, Any]]):
+        # En los productos con shards el stock vigente es el total de stock_rollups.
+        sharded = {p['id']: p for p in products if int(p.get('stockShards') or 0) > 0}
+        if not sharded:
+            return
+        refs = [self.db.collection(ROLLUPS_COLLECTION).document(product_id) for product_id in sharded]
+        for doc in self.db.get_all(refs):
+            if doc.exists:
+                sharded[doc.id]['stock'] = (doc.to_dict() or {}).get('stock', sharded[doc.id].get('stock'))
+
+    async def list_products(self) -> List[Dict[str, Any]]:
+        def _list():
+            docs = self.db.collection(self.collection).select(PRODUCT_FIELDS).order_by('name').get()
+            products = [self.to_product(doc) for doc in docs]
+            self._apply_stock_rollups(products)
+            return products
+        async with span("firestore products.list"):
+            return await asyncio.to_thread(_list)
+
+    async def get_product(self, product_id: str) -> Optional[Dict[str, Any]]:
+        def _get():
+            doc = self.db.collection(self.collection).document(product_id).get(field_paths=PRODUCT_FIELDS)
+            if not doc.exists:
+                return None
+            product = self.to_product(doc)
+            self._apply_stock_rollups([product])
+            return product
+        async with span("firestore products.get"):
+            return await asyncio.to_thread(_get)
+
+    async def get_products(self, product_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        refs = [self.db.collection(self.collection).document(pid) for pid in dict.fromkeys(product_ids)]
+        if not refs:
+            return {}
+
+        def _get_all():
+            products = {doc.id: self.to_product(doc) for doc in self.db.get_all(refs, field_paths=PRODUCT_FIELDS) if doc.exists}
+            self._apply_stock_rollups(products.values())
+            return products
+        async with span("firestore products.get_all"):
+            return await asyncio.to_thread(_get_all)
+
+    async def get_product_image(self, product_id: str) -> Optional[Tuple[bytes, str]]:
+        doc_ref = self.db.collection(self.collection).document(product_id)
+        async with span("firestore products.get_image"):
+            doc = await asyncio.to_thread(doc_ref.get, field_paths=['imagen', 'imagenHash'])
+        data = doc.to_dict() if doc.exists else None
+        if not data or not data.get('imagen'):
+            return None
+        # La versión sale de los bytes: imagenHash puede estar desfasado si la imagen se
+        # cambió por fuera del repositorio, y con caché inmutable se serviría la anterior.
+        image = bytes(data['imagen'])
+        image_hash = hashlib.sha256(image).hexdigest()
+        if data.get('imagenHash') != image_hash:
+            # Se corrige para que imageUrl en el catálogo apunte a la versión vigente.
+            await asyncio.to_thread(doc_ref.update, {'imagenHash': image_hash})
+        return image, image_hash
+
+    async def decrement_stock(self, quantities: Dict[str, int]):
+        @firestore.transactional
+        def _decrement(trans):
+            writes = []
+            for product_id, quantity in quantities.items():
+                item_writes, _ = plan_decrement(trans, self.db, product_id, quantity, collection=self.collection)
+                writes.extend(item_writes)
+            for ref, data in writes:
+                trans.update(ref, data)
+
+        async with span("firestore products.decrement_stock"):
+            await asyncio.to_thread(_decrement, self.db.transaction())
+
+    async def restore_stock(self, quantities: Dict[str, int]):
+        collection = self.db.collection(self.collection)
+
+        def _restore():
+            # Solo Increment: no compite con las compras. En productos con shards el
+            # stock vuelve a un shard al azar.
+            refs = [collection.document(product_id) for product_id in quantities]
+            batch = self.db.batch()
+            for doc in self.db.get_all(refs, field_paths=['stockShards']):
+                if not doc.exists:
+                    continue
+                shards = int((doc.to_dict() or {}).get('stockShards') or 0)
+                ref = doc.reference
+                if shards > 0:
+                    ref = ref.collection(SHARDS_SUBCOLLECTION).document(str(random.randrange(shards)))
+                batch.update(ref, {'stock': firestore.Increment(quantities[doc.id])})
+            batch.commit()
+
+        async with span("firestore products.restore_stock"):
+            await asyncio.to_thread(_restore)
+
+    async def upsert_products(self, products: List[Dict[str, Any]]) -> List[str]:
+        from services.bulk_catalog import BatchWriter
+
+        collection = self.db.collection(self.collection)
+        writer = BatchWriter(self.db)
+        ids = []
+        for product in products:
+            data = dict(product)
+            product_id = data.pop('id', None)
+            image = data.pop('image', None)
+            if image is not None:
+                data['imagen'] = image
+            if data.get('imagen') is not None:
+                # imagenHash va en la misma escritura que la imagen para no quedar desfasado.
+                data['imagenHash'] = hashlib.sha256(bytes(data['imagen'])).hexdigest()
+            doc_ref = collection.document(str(product_id)) if product_id else collection.document()
+            ids.append(doc_ref.id)
+            await writer.set(doc_ref, data, merge=True)
+        await writer.flush()
+        failed = [r["error"] for r in writer.drain_results() if not r["ok"]]
+        if failed:
+            raise RuntimeError(f"Error al guardar productos: {failed[0]}")
+        return ids
+
+
+def create_product_repository(db: firestore.Client = None, backend: str = None) -> ProductRepository:
+    backend = (backend or os.getenv("STORAGE_BACKEND", "firestore")).lower()
+    if backend == "firestore":
+        return FirestoreProductRepository(db)
+    if backend == "sql":
+        from repositories.sql_products import SqlProductRepository
+        return SqlProductRepository(os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./catalog.db"))
+    raise ValueError(f"STORAGE_BACKEND no soportado: {backend}")
@@ -0,0 +1,191 @@
+import hashlib
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from models import Base, Categoria, Producto, product_image_url
+from repositories.products import ProductRepository
+
+
+def _to_product(producto: Producto) -> Dict[str, Any]:
+    return {
+        "id": str(producto.id),
+        "name": producto.nombre,
+        "price": producto.precio,
+        "stock": producto.cantidad,
+        "description": producto.descripcion,
+        "imageUrl": producto.imagen_url or product_image_url(producto.id, producto.imagen_hash),
+        "categoryId": producto.categoria_id,
+    }
+
+
+# Claves del contrato del repositorio -> columnas de Producto.
+_FIELD_COLUMNS = {
+    "name": "nombre",
+    "price": "precio",
+    "stock": "cantidad",
+    "description": "descripcion",
+    "imageUrl": "imagen_url",
+    "categoryId": "categoria_id",
+}
+
+
+def _parse_ids(product_ids: Iterable[str]) -> List[int]:
+    ids = []
+    for product_id in product_ids:
+        try:
+            ids.append(int(product_id))
+        except (TypeError, ValueError):
+            continue
+    return ids
+
+
+class SqlProductRepository(ProductRepository):
+    # Los ids son enteros serializados como texto. El stock vive en la columna cantidad:
+    # las reservas y el checkout lo mueven con decrement_stock/restore_stock, cada uno
+    # un único UPDATE para todo el carrito.
+
+    def __init__(self, database_url: str, pool_size: int = 10, max_overflow: int = 20, echo: bool = False):
+        engine_options = {"echo": echo, "pool_pre_ping": True}
+        if not database_url.startswith("sqlite"):
+            engine_options.update(pool_size=pool_size, max_overflow=max_overflow)
+        self.engine = create_async_engine(database_url, **engine_options)
+        self.session_factory = async_sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+
+    async def init(self):
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    async def close(self):
+        await self.engine.dispose()
+
+    async def list_products(self) -> List[Dict[str, Any]]:
+        async with self.session_factory() as session:
+            result = await session.scalars(select(Producto).order_by(Producto.nombre))
+            return [_to_product(p) for p in result]
+
+    async def get_product(self, product_id: str) -> Optional[Dict[str, Any]]:
+        ids = _parse_ids([product_id])
+        if not ids:
+            return None
+        async with self.session_factory() as session:
+            producto = await session.get(Producto, ids[0])
+            return _to_product(producto) if producto else None
+
+    async def get_products(self, product_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        ids = _parse_ids(product_ids)
+        if not ids:
+            return {}
+        async with self.session_factory() as session:
+            result = await session.scalars(select(Producto).where(Producto.id.in_(ids)))
+            return {str(p.id): _to_product(p) for p in result}
+
+    async def get_product_image(self, product_id: str) -> Optional[Tuple[bytes, str]]:
+        ids = _parse_ids([product_id])
+        if not ids:
+            return None
+        async with self.session_factory() as session:
+            row = (await session.execute(
+                select(Producto.imagen, Producto.imagen_hash).where(Producto.id == ids[0])
+            )).first()
+        if row is None or not row.imagen:
+            return None
+        return row.imagen, row.imagen_hash or hashlib.sha256(row.imagen).hexdigest()
+
+    def _quantities_by_id(self, quantities: Dict[str, int]) -> Dict[int, int]:
+        ids = {}
+        for product_id, quantity in quantities.items():
+            parsed = _parse_ids([product_id])
+            if not parsed:
+                raise ValueError(f"Producto {product_id} no encontrado.")
+            ids[parsed[0]] = ids.get(parsed[0], 0) + int(quantity)
+        return ids
+
+    async def decrement_stock(self, quantities: Dict[str, int]):
+        ids = self._quantities_by_id(quantities)
+        if not ids:
+            return
+        # Un solo UPDATE ... CASE: la condición cantidad >= pedido se evalúa fila por fila
+        # dentro de la sentencia, así dos compras concurrentes no pueden dejar stock negativo.
+        requested = case(ids, value=Producto.id)
+        stmt = (
+            update(Producto)
+            .where(Producto.id.in_(list(ids)), Producto.cantidad >= requested)
+            .values(cantidad=Producto.cantidad - requested)
+            .execution_options(synchronize_session=False)
+        )
+        async with self.session_factory() as session, session.begin():
+            result = await session.execute(stmt)
+            if result.rowcount == len(ids):
+                return
+            # Algún producto no alcanzó: se informa cuál y la transacción se revierte.
+            rows = await session.execute(
+                select(Producto.id, Producto.nombre, Producto.cantidad).where(Producto.id.in_(list(ids)))
+            )
+            current = {row.id: row for row in rows}
+            for product_id, quantity in ids.items():
+                row = current.get(product_id)
+                if row is None:
+                    raise ValueError(f"Producto {product_id} no encontrado.")
+                if (row.cantidad or 0) < quantity:
+                    raise ValueError(f"Stock insuficiente para {row.nombre or product_id}.")
+            raise ValueError("No se pudo descontar el stock.")
+
+    async def restore_stock(self, quantities: Dict[str, int]):
+        ids = self._quantities_by_id(quantities)
+        if not ids:
+            return
+        stmt = (
+            update(Producto)
+            .where(Producto.id.in_(list(ids)))
+            .values(cantidad=func.coalesce(Producto.cantidad, 0) + case(ids, value=Producto.id))
+            .execution_options(synchronize_session=False)
+        )
+        async with self.session_factory() as session, session.begin():
+            await session.execute(stmt)
+
+    async def _category(self, session: AsyncSession, name: str, cache: Dict[str, Categoria]) -> Categoria:
+        categoria = cache.get(name)
+        if categoria is None:
+            categoria = await session.scalar(select(Categoria).where(Categoria.nombre == name))
+            if categoria is None:
+                categoria = Categoria(nombre=name)
+                session.add(categoria)
+            cache[name] = categoria
+        return categoria
+
+    async def upsert_products(self, products: List[Dict[str, Any]]) -> List[str]:
+        parsed = []
+        for product in products:
+            product_id = product.get('id')
+            ids = _parse_ids([product_id])
+            if product_id not in (None, "") and not ids:
+                raise ValueError(f"Id de producto inválido para el catálogo SQL: {product_id}")
+            parsed.append(ids[0] if ids else None)
+
+        async with self.session_factory() as session, session.begin():
+            existing_ids = [pid for pid in parsed if pid is not None]
+            existing = {}
+            if existing_ids:
+                result = await session.scalars(select(Producto).where(Producto.id.in_(existing_ids)))
+                existing = {p.id: p for p in result}
+            categories: Dict[str, Categoria] = {}
+            rows = []
+            for product, product_id in zip(products, parsed):
+                producto = existing.get(product_id)
+                if producto is None:
+                    producto = Producto(id=product_id) if product_id is not None else Producto()
+                    session.add(producto)
+                    if product_id is not None:
+                        existing[product_id] = producto
+                for key, column in _FIELD_COLUMNS.items():
+                    if key in product:
+                        setattr(producto, column, product[key])
+                if product.get('category') is not None:
+                    producto.categoria = await self._category(session, str(product['category']), categories)
+                if product.get('image') is not None:
+                    producto.imagen = product['image']
+                rows.append(producto)
+            await session.flush()
+            return [str(p.id) for p in rows]
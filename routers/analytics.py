@@ -0,0 +1,50 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from firebase_admin import firestore
+from typing import Optional
+from services.admin_auth import require_admin
+from services.sales_analytics import DAILY_COLLECTION, PRODUCTS_COLLECTION, COMUNAS_COLLECTION
+
+db_client: firestore.Client = None
+
+def router(db: firestore.Client):
+    global db_client
+    db_client = db
+    router = APIRouter()
+
+    @router.get("/analytics/sales", dependencies=[Depends(require_admin)])
+    async def get_sales_analytics_endpoint(
+        start: Optional[str] = Query(None, description="Fecha inicial YYYY-MM-DD"),
+        end: Optional[str] = Query(None, description="Fecha final YYYY-MM-DD"),
+        top: int = Query(10, ge=1, le=100),
+    ):
+        try:
+            daily_query = db_client.collection(DAILY_COLLECTION)
+            if start:
+                daily_query = daily_query.where('date', '>=', start)
+            if end:
+                daily_query = daily_query.where('date', '<=', end)
+            daily = [doc.to_dict() for doc in daily_query.order_by('date').stream()]
+
+            products = [
+                doc.to_dict() for doc in db_client.collection(PRODUCTS_COLLECTION)
+                .order_by('units', direction=firestore.Query.DESCENDING).limit(top).stream()
+            ]
+            comunas = [
+                doc.to_dict() for doc in db_client.collection(COMUNAS_COLLECTION)
+                .order_by('orders', direction=firestore.Query.DESCENDING).limit(top).stream()
+            ]
+
+            return {
+                "totals": {
+                    "revenue": sum(d.get('revenue', 0) for d in daily),
+                    "orders": sum(d.get('orders', 0) for d in daily),
+                    "units": sum(d.get('units', 0) for d in daily),
+                },
+                "daily": daily,
+                "topProducts": products,
+                "topComunas": comunas,
+            }
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error interno del servidor al obtener analíticas: {str(e)}")
+
+    return router
@@ -0,0 +1,20 @@
+from fastapi import APIRouter, HTTPException
+from repositories.products import ProductRepository
+from schemas import CartValidationRequest, CartValidationResponse
+from services.cart_pricing import price_cart
+
+product_repository: ProductRepository = None
+
+def router(repository: ProductRepository):
+    global product_repository
+    product_repository = repository
+    router = APIRouter()
+
+    @router.post("/cart/validate", response_model=CartValidationResponse)
+    async def validate_cart_endpoint(cart: CartValidationRequest):
+        try:
+            return await price_cart(product_repository, ((line.id, line.quantity) for line in cart.items))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error interno del servidor al validar el carrito: {str(e)}")
+
+    return router
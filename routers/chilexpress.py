@@ -1,17 +1,67 @@
 from fastapi import APIRouter, HTTPException, Query, Depends, Body
+from fastapi.responses import Response
 from services.chilexpress_api import ChilexpressApiService
 from typing import Dict, Any, List
 from schemas import ShippingAddress
 from firebase_admin import firestore
 from init_transaction import FinalizeOrderPayload, OrderItem, ShippingInfo, UserInfo
+from services.sales_analytics import enqueue_order_for_aggregates
+from services.shared_cache import SharedCache
+from services.profiling import span
+from services.cart_pricing import price_cart, NOT_FOUND
+from services.stock_reservations import plan_decrement, plan_surplus_release, read_held_reservation, split_against_reservation, mark_confirmed
+from services.address_georeference import AddressGeoreferencer
+from services.shipping_rates import ShippingQuoter
+from services.tbk_reconciler import TbkReconciler
+from services.shipping_labels import LabelBlobStore, create_label_store, decode_label, label_media_type, offload_labels
+from repositories.products import ProductRepository, FirestoreProductRepository
+import asyncio
 import datetime
 
 chilexpress_service: ChilexpressApiService = None
-
-def router(chilexpress_config: Dict, db: firestore.Client): 
-    global chilexpress_service
-    if chilexpress_service is None:
-        chilexpress_service = ChilexpressApiService(chilexpress_config)
+product_repository: ProductRepository = None
+label_store: LabelBlobStore = None
+georeferencer: AddressGeoreferencer = None
+shipping_quoter: ShippingQuoter = None
+tbk_reconciler: TbkReconciler = None
+
+def _order_transport_numbers(order: Dict[str, Any]) -> set:
+    shipping = order.get('shipping') or {}
+    details = ((shipping.get('chilexpressResponse') or {}).get('data') or {}).get('detail') or []
+    return {str(d['transportOrderNumber']) for d in details if isinstance(d, dict) and d.get('transportOrderNumber')}
+
+def _store_tracking(db: firestore.Client, order_id: str, transport_order_number: Any, response: Dict[str, Any]):
+    data = (response or {}).get("data") or {}
+    order_data = data.get("transportOrderData") or {}
+    tracking = {
+        "status": order_data.get("status") or order_data.get("statusDescription"),
+        "events": data.get("trackingEvents") or [],
+    }
+    order_ref = db.collection('orders').document(order_id)
+    snapshot = order_ref.get()
+    if not snapshot.exists:
+        return
+    order = snapshot.to_dict() or {}
+    # El endpoint es público: solo se escribe en la orden si la OT consultada es suya.
+    if transport_order_number is None or str(transport_order_number) not in _order_transport_numbers(order):
+        print(f"Advertencia: la OT {transport_order_number} no pertenece a la orden {order_id}; no se guarda el seguimiento.")
+        return
+    if ((order.get('shipping') or {}).get('tracking')) == tracking:
+        return
+    order_ref.update({'shipping.tracking': tracking, 'updatedAt': firestore.SERVER_TIMESTAMP})
+
+def router(chilexpress_config: Dict, db: firestore.Client, cache: SharedCache = None, repository: ProductRepository = None,
+           labels: LabelBlobStore = None, quoter: ShippingQuoter = None, reconciler: TbkReconciler = None): 
+    global chilexpress_service, product_repository, label_store, georeferencer, shipping_quoter, tbk_reconciler
+    if quoter is not None:
+        chilexpress_service = quoter.service
+    elif chilexpress_service is None:
+        chilexpress_service = ChilexpressApiService(chilexpress_config, cache=cache)
+    shipping_quoter = quoter or ShippingQuoter(chilexpress_service, db)
+    georeferencer = AddressGeoreferencer(db, chilexpress_service, cache=cache)
+    product_repository = repository or FirestoreProductRepository(db)
+    label_store = labels or create_label_store()
+    tbk_reconciler = reconciler or TbkReconciler(db, cache=cache)
 
     router = APIRouter()
 
@@ -38,8 +88,17 @@ def router(chilexpress_config: Dict, db: firestore.Client):
     @router.post("/chilexpress/georeferencia")
     async def georeference_chilexpress_endpoint(address: ShippingAddress):
         address_dict = address.dict(by_alias=True, exclude_unset=True)
-        
-        return await chilexpress_service.georeference_address(address_data=address_dict)
+        # Las direcciones guardadas reutilizan el resultado almacenado en su documento.
+        result = await georeferencer.resolve(address_dict, address.id)
+        return result["response"]
+
+    @router.post("/addresses/{address_id}/georeference")
+    async def georeference_saved_address_endpoint(address_id: str):
+        # Pensado para llamarse al guardar la dirección, así el checkout ya la encuentra resuelta.
+        result = await georeferencer.resolve_saved(address_id)
+        if result is None:
+            raise HTTPException(status_code=404, detail="Dirección no encontrada")
+        return {key: value for key, value in result.items() if key != "response"}
 
     @router.get("/chilexpress/oficinas-de-entrega/{region_id}/{commune_name}")
     async def get_oficinas_de_entrega_endpoint(region_id: str, commune_name: str):
@@ -47,7 +106,16 @@ def router(chilexpress_config: Dict, db: firestore.Client):
 
     @router.post("/chilexpress/cotizar-envio")
     async def cotizar_envio_endpoint(cotizacion_body: Dict):
-        return await chilexpress_service.quote_shipping(quote_body=cotizacion_body)
+        # Con addressId se completa el destino desde la georreferencia guardada.
+        address_id = cotizacion_body.pop("addressId", None)
+        if address_id and not cotizacion_body.get("destinationCountyCode"):
+            result = await georeferencer.resolve_saved(address_id)
+            if result is None:
+                raise HTTPException(status_code=404, detail="Dirección no encontrada")
+            cotizacion_body["destinationCountyCode"] = result.get("coverageCode")
+        # Si Chilexpress no responde dentro del presupuesto se responde con una estimación
+        # local ("estimated": true); el precio final lo fija la creación del envío.
+        return await shipping_quoter.quote(cotizacion_body)
 
     @router.post("/chilexpress/crear-envio")
     async def crear_envio_endpoint(envio_body: Dict):
@@ -55,7 +123,43 @@ def router(chilexpress_config: Dict, db: firestore.Client):
 
     @router.post("/chilexpress/tracking")
     async def consulta_envio_endpoint(consult_body: Dict):
-        return await chilexpress_service.track_shipping(tracking_body=consult_body)
+        order_id = consult_body.pop("orderId", None)
+        response = await chilexpress_service.track_shipping(tracking_body=consult_body)
+        if order_id:
+            # Guardar el seguimiento en la orden lo publica a los clientes conectados a /orders/events.
+            try:
+                await asyncio.to_thread(_store_tracking, db, order_id, consult_body.get("transportOrderNumber"), response)
+            except Exception as e:
+                print(f"Advertencia: no se pudo guardar el seguimiento de la orden {order_id}: {e}")
+        return response
+
+    @router.get("/orders/{order_id}/shipping-label")
+    async def get_shipping_label_endpoint(order_id: str, index: int = Query(0, ge=0, description="Posición del envío en la orden")):
+        with span("firestore orders.get"):
+            snapshot = await asyncio.to_thread(db.collection('orders').document(order_id).get)
+        if not snapshot.exists:
+            raise HTTPException(status_code=404, detail="Orden no encontrada")
+        response = ((snapshot.to_dict().get('shipping') or {}).get('chilexpressResponse') or {})
+        details = (response.get('data') or {}).get('detail') or []
+        if index >= len(details) or not isinstance(details[index], dict):
+            raise HTTPException(status_code=404, detail="La orden no tiene etiqueta de envío")
+        detail = details[index]
+
+        if detail.get('labelRef'):
+            data = await asyncio.to_thread(label_store.get, detail['labelRef'])
+            if data is None:
+                raise HTTPException(status_code=404, detail="Etiqueta no encontrada en el almacén")
+            media_type = label_media_type(data)
+        elif detail.get('labelData'):
+            # Órdenes aún no migradas con tools.strip_order_labels.
+            data, media_type = decode_label(detail['labelData'])
+        else:
+            raise HTTPException(status_code=404, detail="La orden no tiene etiqueta de envío")
+
+        return Response(content=data, media_type=media_type, headers={
+            "Cache-Control": "private, max-age=86400",
+            "Content-Disposition": f'inline; filename="etiqueta-{order_id}-{index}"',
+        })
 
     @router.post("/chilexpress/process-order-and-shipping")
     async def process_order_and_shipping_endpoint(
@@ -68,7 +172,27 @@ def router(chilexpress_config: Dict, db: firestore.Client):
             shipping_option = payload.shipping_info.option
             user_info = payload.user_info
             buy_order_id = transbank_response['buy_order']
-            total_value = sum(item.price * item.quantity for item in payload.items)
+
+            # Precios y total se calculan en el servidor; el precio enviado por el cliente se ignora.
+            # El stock lo valida full_process, que conoce las reservas hechas en /api/init-tx.
+            cart = await price_cart(product_repository, ((item.id, item.quantity) for item in payload.items))
+            missing = [line.id for line in cart.items if line.error == NOT_FOUND]
+            if missing:
+                raise HTTPException(status_code=400, detail=f"Productos no encontrados: {', '.join(missing)}")
+            unit_prices = {line.id: line.unitPrice for line in cart.items}
+            priced_items = [{**item.dict(), "price": unit_prices[item.id]} for item in payload.items]
+            total_value = sum(line.lineTotal for line in cart.items)
+
+            # El pago se verifica con el commit registrado en el servidor, no con el cuerpo
+            # que envía el navegador.
+            payment = await tbk_reconciler.committed_payment(buy_order_id)
+            if payment is None:
+                raise HTTPException(status_code=409, detail=f"El pago de la orden {buy_order_id} no está confirmado.")
+            paid_amount = float(payment.get('amount') or 0)
+            if round(paid_amount) < round(total_value):
+                raise HTTPException(status_code=409, detail=f"El monto pagado ({paid_amount:g}) es menor al total de la orden ({total_value:g}).")
+
+            destination_coverage = await georeferencer.stored_coverage_code(shipping_address, shipping_address.get("id"))
 
             shipment_body = {
                 "header": {
@@ -82,7 +206,7 @@ def router(chilexpress_config: Dict, db: firestore.Client):
                     "addresses": [
                         {
                             "addressId": 0,
-                            "countyCoverageCode": shipping_address.get("comuna_cod"),
+                            "countyCoverageCode": destination_coverage,
                             "streetName": shipping_address.get("calle"),
                             "streetNumber": shipping_address.get("nro"),
                             "supplement": shipping_address.get("suplemento", ""),
@@ -155,34 +279,53 @@ def router(chilexpress_config: Dict, db: firestore.Client):
                     chilexpress_response["data"]["detail"][0]["reference"] = reference_number
             
             print(f"DEBUG: Extracted transport_order_number: {transport_order_number}, reference_number: {reference_number}")
+
+            # La etiqueta (base64, varios KB) va al almacén de blobs; la orden solo guarda labelRef.
+            chilexpress_response, _ = await asyncio.to_thread(offload_labels, chilexpress_response, label_store)
             print(f"DEBUG: chilexpress_response after setting values: {chilexpress_response}")
 
 
             order_ref = db.collection('orders').document()
             transaction = db.transaction()
 
+            # El stock ya retenido en /api/init-tx no se vuelve a descontar: solo se
+            # descuenta lo que falte por producto y lo retenido de más se devuelve.
+            quantities, names = {}, {}
+            for item in payload.items:
+                quantities[item.id] = quantities.get(item.id, 0) + item.quantity
+                names.setdefault(item.id, item.name)
+            firestore_stock = product_repository.firestore_stock
+            external_shortfall, external_surplus = {}, {}
+            if not firestore_stock:
+                # Catálogo fuera de Firestore: el repositorio mueve el stock antes de la
+                # transacción de la orden y se compensa si esta falla.
+                reservation = await asyncio.to_thread(read_held_reservation, None, db, buy_order_id)
+                external_shortfall, external_surplus = split_against_reservation(quantities, reservation)
+                await product_repository.decrement_stock(external_shortfall)
+
             @firestore.transactional
             def full_process(trans):
-                product_updates = {}
-                for item in payload.items:
-                    product_ref = db.collection('products').document(item.id)
-                    snapshot = product_ref.get(transaction=trans)
-                    if not snapshot.exists: raise ValueError(f"Producto {item.id} no encontrado.")
-                    current_stock = snapshot.to_dict().get('stock', 0)
-                    if current_stock < item.quantity: raise ValueError(f"Stock insuficiente para {item.name}.")
-                    product_updates[item.id] = current_stock - item.quantity
-
-                for product_id, new_stock in product_updates.items():
-                    trans.update(db.collection('products').document(product_id), {'stock': new_stock})
-
-
-                card_detail = transbank_response['card_detail']
+                reservation = read_held_reservation(trans, db, buy_order_id)
+                if firestore_stock:
+                    shortfall, _ = split_against_reservation(quantities, reservation)
+                    stock_writes = []
+                    for product_id, pending in shortfall.items():
+                        item_writes, _ = plan_decrement(trans, db, product_id, pending, names[product_id])
+                        stock_writes.extend(item_writes)
+                    stock_writes.extend(plan_surplus_release(db, reservation, quantities))
+                    for ref, data in stock_writes:
+                        trans.update(ref, data)
+                if reservation is not None:
+                    mark_confirmed(trans, db, buy_order_id, order_ref.id)
+
+
+                card_detail = payment.get('card_detail') or {}
                 final_order_data = {
                     "userId": user_info.uid,
                     "userEmail": user_info.email,
                     "userName": user_info.name,
                     "userPhoneNumber": user_info.phoneNumber,
-                    "items": [item.dict() for item in payload.items],
+                    "items": priced_items,
                     "totalAmount": total_value,
                     "status": "paid_and_shipping_created",
                     "createdAt": firestore.SERVER_TIMESTAMP,
@@ -193,14 +336,23 @@ def router(chilexpress_config: Dict, db: firestore.Client):
                     "transbank_details": {
                         "buy_order": buy_order_id,
                         "card_number": card_detail.get('card_number'),
-                        "transaction_date": str(transbank_response['transaction_date']),
+                        "transaction_date": str(payment.get('transaction_date')),
                     }
                 }
                 trans.set(order_ref, final_order_data)
+                enqueue_order_for_aggregates(trans, db, order_ref.id, final_order_data)
                 return final_order_data
 
 
-            final_order = full_process(transaction)
+            try:
+                with span("firestore orders.full_process"):
+                    final_order = full_process(transaction)
+            except Exception:
+                if external_shortfall:
+                    await product_repository.restore_stock(external_shortfall)
+                raise
+            if external_surplus:
+                await product_repository.restore_stock(external_surplus)
 
             serializable_order = final_order.copy()
             serializable_order["createdAt"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
@@ -214,6 +366,8 @@ def router(chilexpress_config: Dict, db: firestore.Client):
             }
 
 
+        except HTTPException as http_exc:
+            raise http_exc
         except ValueError as ve:
             raise HTTPException(status_code=400, detail=str(ve))
         except Exception as e:
@@ -1,41 +1,139 @@
-from fastapi import APIRouter, HTTPException
+import asyncio
+import json
+import os
+import tempfile
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query, Request, Depends
+from fastapi.responses import StreamingResponse, FileResponse
 from firebase_admin import firestore
+from services.admin_auth import require_admin
+from services.bulk_catalog import SUPPORTED_FORMATS, aiter_lines, export_products, export_repository_products, import_products
+from repositories.products import ProductRepository, FirestoreProductRepository
+from services.product_images import ProductImageStore, THUMBNAIL_SIZES
+from services.shared_cache import SharedCache
+from services.stock_reservations import enable_sharding
+from services.product_search import ProductSearchIndex
 
 db_client: firestore.Client = None
+product_repository: ProductRepository = None
+image_store: ProductImageStore = None
+catalog_cache: SharedCache = None
+search_index: ProductSearchIndex = None
 
-def router(db: firestore.Client):
-    global db_client
+CATALOG_CACHE_KEY = "catalog:products"
+CATALOG_CACHE_TTL = 30
+
+IMAGE_CACHE_DIR = os.getenv("PRODUCT_IMAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "product-images"))
+
+def router(db: firestore.Client, repository: ProductRepository = None, cache: SharedCache = None,
+           index: ProductSearchIndex = None):
+    global db_client, product_repository, image_store, catalog_cache, search_index
     db_client = db
+    product_repository = repository or FirestoreProductRepository(db)
+    image_store = ProductImageStore(IMAGE_CACHE_DIR)
+    catalog_cache = cache
+    search_index = index
     router = APIRouter()
 
     @router.get("/products")
     async def get_products_endpoint():
         try:
-            products_ref = db_client.collection('products')
-            docs = products_ref.order_by('name').get()
-
-            products_list = []
-            for doc in docs:
-                product_data = doc.to_dict()
-                product_data['id'] = doc.id 
-                products_list.append(product_data)
-            return products_list
+            if catalog_cache is not None:
+                return await catalog_cache.get_or_load(CATALOG_CACHE_KEY, CATALOG_CACHE_TTL, product_repository.list_products)
+            return await product_repository.list_products()
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error interno del servidor al obtener productos: {str(e)}")
 
+    @router.get("/products/search")
+    async def search_products_endpoint(
+        q: str = Query("", description="Texto a buscar en nombre y descripción"),
+        category: Optional[str] = Query(None),
+        min_price: Optional[float] = Query(None, ge=0),
+        max_price: Optional[float] = Query(None, ge=0),
+        page: int = Query(1, ge=1),
+        page_size: int = Query(20, ge=1, le=100),
+    ):
+        if search_index is None:
+            raise HTTPException(status_code=503, detail="El índice de búsqueda no está disponible.")
+        # La consulta es CPU (NumPy) y toma el lock del índice: fuera del event loop.
+        return await asyncio.to_thread(search_index.search, q, category=category, min_price=min_price,
+                                       max_price=max_price, page=page, page_size=page_size)
+
     @router.get("/products/{product_id}")
     async def get_product_endpoint(product_id: str):
         try:
-            doc_ref = db_client.collection('productos').document(product_id)
-            doc = doc_ref.get()
-
-            if not doc.exists:
+            product_data = await product_repository.get_product(product_id)
+            if product_data is None:
                 raise HTTPException(status_code=404, detail="Producto no encontrado")
-
-            product_data = doc.to_dict()
-            product_data['id'] = doc.id
             return product_data
+        except HTTPException as http_exc:
+            raise http_exc
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error interno del servidor al obtener producto: {str(e)}")
 
+    @router.get("/products/{product_id}/image")
+    async def get_product_image_endpoint(
+        product_id: str,
+        size: Optional[int] = Query(None, description=f"Miniatura: {', '.join(map(str, THUMBNAIL_SIZES))}"),
+        v: Optional[str] = Query(None, description="Hash de contenido de la imagen"),
+    ):
+        if size is not None and size not in THUMBNAIL_SIZES:
+            raise HTTPException(status_code=400, detail=f"Tamaño no soportado. Usa uno de: {list(THUMBNAIL_SIZES)}")
+        try:
+            image = await image_store.get(product_repository, product_id, size=size, version=v)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error interno del servidor al obtener la imagen: {str(e)}")
+        if image is None:
+            raise HTTPException(status_code=404, detail="Imagen no encontrada")
+
+        path, media_type, version = image
+        if v == version:
+            cache_control = "public, max-age=31536000, immutable"
+        else:
+            cache_control = "public, max-age=300"
+        return FileResponse(path, media_type=media_type, headers={"Cache-Control": cache_control, "ETag": f'"{version}-{size or 0}"'})
+
+    @router.post("/admin/products/{product_id}/stock-shards", dependencies=[Depends(require_admin)])
+    async def set_stock_shards_endpoint(product_id: str, count: int = Query(..., ge=0, le=100)):
+        if not product_repository.firestore_stock:
+            # En SQL el UPDATE condicional ya serializa por fila; los shards son de Firestore.
+            raise HTTPException(status_code=400, detail="Los shards de stock solo aplican al catálogo en Firestore.")
+        try:
+            return await asyncio.to_thread(enable_sharding, db_client, product_id, count)
+        except ValueError as ve:
+            raise HTTPException(status_code=404, detail=str(ve))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error interno del servidor al configurar shards de stock: {str(e)}")
+
+    @router.post("/admin/products/import", dependencies=[Depends(require_admin)])
+    async def import_products_endpoint(
+        request: Request,
+        format: str = Query("ndjson", description="csv o ndjson"),
+        dry_run: bool = Query(False),
+    ):
+        if format not in SUPPORTED_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Formato no soportado: {format}")
+
+        async def report_stream():
+            lines = aiter_lines(request.stream())
+            async for report in import_products(db_client, lines, fmt=format, dry_run=dry_run, repository=product_repository):
+                yield json.dumps(report, ensure_ascii=False) + "\n"
+            if catalog_cache is not None and not dry_run:
+                await catalog_cache.delete(CATALOG_CACHE_KEY)
+
+        return StreamingResponse(report_stream(), media_type="application/x-ndjson")
+
+    @router.get("/admin/products/export", dependencies=[Depends(require_admin)])
+    async def export_products_endpoint(format: str = Query("ndjson", description="csv o ndjson")):
+        if format not in SUPPORTED_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Formato no soportado: {format}")
+        media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+        rows = (export_products(db_client, fmt=format) if product_repository.firestore_stock
+                else export_repository_products(product_repository, fmt=format))
+        return StreamingResponse(
+            rows,
+            media_type=media_type,
+            headers={"Content-Disposition": f'attachment; filename="products.{format}"'},
+        )
+
     return router
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import PlainTextResponse
+from services.admin_auth import require_admin
+from services.profiling import RequestProfiler
+
+request_profiler: RequestProfiler = None
+
+def router(profiler: RequestProfiler):
+    global request_profiler
+    request_profiler = profiler
+    router = APIRouter(dependencies=[Depends(require_admin)])
+
+    @router.get("/admin/profiles")
+    async def list_profiles_endpoint():
+        return [trace.summary() for trace in reversed(request_profiler.traces)]
+
+    @router.get("/admin/profiles/{trace_id}")
+    async def get_profile_endpoint(trace_id: str):
+        trace = request_profiler.get(trace_id)
+        if trace is None:
+            raise HTTPException(status_code=404, detail="Perfil no encontrado")
+        return trace.as_dict()
+
+    @router.get("/admin/profiles/{trace_id}/flamegraph", response_class=PlainTextResponse)
+    async def get_profile_flamegraph_endpoint(trace_id: str):
+        trace = request_profiler.get(trace_id)
+        if trace is None:
+            raise HTTPException(status_code=404, detail="Perfil no encontrado")
+        return PlainTextResponse(
+            trace.collapsed_stacks(),
+            headers={"Content-Disposition": f'attachment; filename="profile-{trace_id}.folded"'},
+        )
+
+    return router
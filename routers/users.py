@@ -1,18 +1,25 @@
-from fastapi import APIRouter, HTTPException, Query, Body
+from fastapi import APIRouter, HTTPException, Query, Body, Depends
+from fastapi.responses import StreamingResponse
 from firebase_admin import firestore
 from datetime import datetime
 from typing import Optional, List, Dict, Any
 from schemas import Order 
+from services.admin_auth import require_admin
+from services.bulk_catalog import seed_orders
+from services.profiling import span
+from services.order_events import OrderEventHub
 try:
     from google.cloud.firestore_v1.base_client import DatetimeWithNanoseconds
 except ImportError:
     DatetimeWithNanoseconds = type(None) 
 
 db_client: firestore.Client = None
+order_events: OrderEventHub = None
 
-def router(db: firestore.Client):
-    global db_client
+def router(db: firestore.Client, events: OrderEventHub = None):
+    global db_client, order_events
     db_client = db
+    order_events = events
     router = APIRouter()
 
     @router.get("/users")
@@ -70,6 +77,16 @@ def router(db: firestore.Client):
             print(f"Error al obtener direcciones para el usuario {user_id} desde Firestore: {e}")
             raise HTTPException(status_code=500, detail=f"Error interno del servidor al obtener Direcciones: {str(e)}")
 
+    @router.get("/orders/events")
+    async def order_events_endpoint(user_id: str = Query(..., description="Usuario cuyas órdenes se siguen")):
+        # Server-Sent Events: reemplaza el polling de /orders y /chilexpress/tracking.
+        if order_events is None:
+            raise HTTPException(status_code=503, detail="Las notificaciones de órdenes no están disponibles.")
+        return StreamingResponse(order_events.stream(user_id), media_type="text/event-stream", headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        })
+
     @router.get("/orders", response_model=List[Order])
     async def get_user_orders_endpoint(user_id: Optional[str] = Query(None, description="Filtra órdenes por ID de usuario")):
         orders_ref = db_client.collection('orders')
@@ -79,7 +96,8 @@ def router(db: firestore.Client):
             query_ref = query_ref.where("userId", "==", user_id)
 
         try:
-            docs = query_ref.stream()
+            with span("firestore orders.query"):
+                docs = list(query_ref.stream())
             orders_list = []
             for doc in docs:
                 order_data = doc.to_dict()
@@ -187,10 +205,18 @@ def router(db: firestore.Client):
 
 
         try:
-            doc_ref = await orders_ref.add(order_dict)
+            doc_ref = orders_ref.add(order_dict)
             return {"message": "Orden de prueba creada exitosamente", "order_id": doc_ref[1].id if isinstance(doc_ref, tuple) else doc_ref.id}
         except Exception as e:
             print(f"Error al crear la orden de prueba en Firestore: {e}")
             raise HTTPException(status_code=500, detail=f"Error interno del servidor al crear la orden de prueba: {e}")
 
+    @router.post("/admin/orders/seed", status_code=201, dependencies=[Depends(require_admin)])
+    async def seed_orders_endpoint(count: int = Query(1000, ge=1, le=100000)):
+        try:
+            return await seed_orders(db_client, count)
+        except Exception as e:
+            print(f"Error al generar órdenes de prueba en Firestore: {e}")
+            raise HTTPException(status_code=500, detail=f"Error interno del servidor al generar órdenes de prueba: {e}")
+
     return router
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from typing import Optional, List, Dict, Any
 
 class TransactionBase(BaseModel):
@@ -49,6 +49,7 @@ class ChilexpressDetail(BaseModel):
     genericString2: Optional[str] = None
     groupReference: Optional[str] = None
     labelData: Optional[str] = None 
+    labelRef: Optional[str] = None
     labelType: Optional[str] = None
     labelVersion: Optional[str] = None
     printedDate: Optional[str] = None
@@ -118,3 +119,50 @@ class Order(BaseModel):
     shipping: Optional[ShippingDetails] = None 
     notes: Optional[str] = None
 
+
+class ProductImportRow(BaseModel):
+    # Con id la fila actualiza solo las columnas presentes (p. ej. id + stock); sin id
+    # crea un producto y entonces name y price son obligatorios.
+    id: Optional[str] = None
+    name: Optional[str] = Field(None, min_length=1)
+    price: Optional[float] = Field(None, ge=0)
+    stock: int = Field(0, ge=0)
+    description: Optional[str] = None
+    imageUrl: Optional[str] = None
+    category: Optional[str] = None
+
+    @model_validator(mode="after")
+    def _new_products_need_name_and_price(self):
+        if not self.id:
+            missing = [field for field in ("name", "price") if getattr(self, field) is None]
+            if missing:
+                raise ValueError(f"Para crear un producto (fila sin id) falta: {', '.join(missing)}")
+        return self
+
+
+class CartLine(BaseModel):
+    id: str
+    quantity: int = Field(..., ge=1)
+
+
+class CartValidationRequest(BaseModel):
+    items: List[CartLine]
+
+
+class CartLineResult(BaseModel):
+    id: str
+    name: Optional[str] = None
+    quantity: int
+    unitPrice: Optional[float] = None
+    lineTotal: float = 0
+    stock: Optional[int] = None
+    available: bool
+    error: Optional[str] = None
+
+
+class CartValidationResponse(BaseModel):
+    valid: bool
+    items: List[CartLineResult]
+    itemCount: int
+    subtotal: float
+    currency: str = "CLP"
@@ -0,0 +1,149 @@
+import asyncio
+import hashlib
+import json
+from typing import Any, Dict, Optional
+
+from firebase_admin import firestore
+
+from services.chilexpress_api import ChilexpressApiService
+from services.product_search import fold
+from services.profiling import span
+from services.shared_cache import SharedCache
+
+ADDRESSES_COLLECTION = 'addresses'
+GEOREFERENCE_FIELD = 'georeference'
+GEOREFERENCE_CACHE_TTL = 7 * 24 * 3600
+
+# Campos que determinan la georreferencia. El suplemento (depto, oficina) y el alias
+# no cambian el punto de entrega, así que editarlos no invalida el resultado.
+# Cada campo admite el nombre del documento de Firestore y el alias que usa Chilexpress.
+_FINGERPRINT_FIELDS = (
+    ("calle", "streetName"),
+    ("nro", "number"),
+    ("comuna", "countyName"),
+    ("comuna_cod", "countyCode"),
+    ("region", "region"),
+)
+
+
+def _normalize(value: Any) -> str:
+    return " ".join(fold(str(value)).split()) if value is not None else ""
+
+
+def address_fingerprint(address: Dict[str, Any]) -> str:
+    parts = []
+    for field, alias in _FINGERPRINT_FIELDS:
+        value = address.get(field)
+        parts.append(_normalize(value if value is not None else address.get(alias)))
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()[:32]
+
+
+def georeference_body(address: Dict[str, Any]) -> Dict[str, Any]:
+    # Acepta tanto el documento guardado como el cuerpo que ya usa los alias.
+    body = {}
+    for field, alias in _FINGERPRINT_FIELDS + (("suplemento", "supplement"),):
+        value = address.get(alias, address.get(field))
+        if value is not None:
+            body[alias] = value
+    return body
+
+
+def summarize_georeference(response: Dict[str, Any]) -> Dict[str, Any]:
+    data = (response or {}).get("data") or {}
+    return {
+        "coverageCode": data.get("coverageCode") or data.get("countyCoverageCode") or data.get("countyCode"),
+        "latitude": data.get("latitude"),
+        "longitude": data.get("longitude"),
+        "streetId": data.get("streetId"),
+    }
+
+
+class AddressGeoreferencer:
+    # La georreferencia se guarda en el propio documento de la dirección junto al hash
+    # de los campos normalizados: mientras la dirección no cambie, ni el checkout ni la
+    # cotización ni la creación del envío vuelven a llamar a Chilexpress. Las direcciones
+    # sin documento (aún no guardadas) usan la caché compartida con la misma clave.
+    def __init__(self, db: firestore.Client, service: ChilexpressApiService, cache: Optional[SharedCache] = None):
+        self.db = db
+        self.service = service
+        self.cache = cache
+        self._background: set = set()
+
+    def _ref(self, address_id: str):
+        return self.db.collection(ADDRESSES_COLLECTION).document(address_id)
+
+    async def _load_document(self, address_id: str) -> Optional[Dict[str, Any]]:
+        async with span("firestore addresses.get"):
+            snapshot = await asyncio.to_thread(self._ref(address_id).get)
+        return snapshot.to_dict() if snapshot.exists else None
+
+    async def _fetch(self, address: Dict[str, Any], fingerprint: str) -> Dict[str, Any]:
+        response = await self.service.georeference_address(address_data=georeference_body(address))
+        # Ida y vuelta por JSON para guardar solo tipos que Firestore y la caché aceptan.
+        response = json.loads(json.dumps(response, default=str))
+        return {"hash": fingerprint, **summarize_georeference(response), "response": response}
+
+    async def resolve(self, address: Dict[str, Any], address_id: Optional[str] = None) -> Dict[str, Any]:
+        fingerprint = address_fingerprint(address)
+        document = await self._load_document(address_id) if address_id else None
+        if document is not None:
+            stored = document.get(GEOREFERENCE_FIELD) or {}
+            if stored.get("hash") == fingerprint:
+                return stored
+
+        cache_key = f"georeference:{fingerprint}"
+        result = None
+        if self.cache is not None:
+            result = await self.cache.get(cache_key)
+        if result is None:
+            result = await self._fetch(address, fingerprint)
+            if self.cache is not None:
+                await self.cache.set(cache_key, result, GEOREFERENCE_CACHE_TTL)
+
+        # Solo se persiste si coincide con lo guardado: una edición aún no guardada
+        # no debe quedar asociada al documento.
+        if document is not None and address_fingerprint(document) == fingerprint:
+            async with span("firestore addresses.update"):
+                await asyncio.to_thread(self._ref(address_id).update, {
+                    GEOREFERENCE_FIELD: {**result, "updatedAt": firestore.SERVER_TIMESTAMP},
+                })
+        return result
+
+    async def resolve_saved(self, address_id: str) -> Optional[Dict[str, Any]]:
+        document = await self._load_document(address_id)
+        if document is None:
+            return None
+        return await self.resolve(document, address_id)
+
+    async def _stored(self, address: Dict[str, Any], address_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        fingerprint = address_fingerprint(address)
+        document = await self._load_document(address_id) if address_id else None
+        stored = (document or {}).get(GEOREFERENCE_FIELD) or {}
+        if stored.get("hash") == fingerprint:
+            return stored
+        if self.cache is not None:
+            return await self.cache.get(f"georeference:{fingerprint}")
+        return None
+
+    async def _resolve_in_background(self, address: Dict[str, Any], address_id: Optional[str]):
+        try:
+            await self.resolve(address, address_id)
+        except Exception as e:
+            print(f"Advertencia: no se pudo georreferenciar la dirección {address_id or ''}: {e}")
+
+    async def stored_coverage_code(self, address: Dict[str, Any], address_id: Optional[str] = None) -> Optional[str]:
+        # Para la creación del envío: nunca espera a Chilexpress. Usa el resultado
+        # guardado en la dirección o en la caché; si no hay ninguno sigue con el código
+        # de comuna de la dirección y resuelve en segundo plano para la próxima vez.
+        fallback = address.get("comuna_cod")
+        try:
+            result = await self._stored(address, address_id)
+        except Exception as e:
+            print(f"Advertencia: no se pudo leer la georreferencia de la dirección {address_id or ''}: {e}")
+            return fallback
+        if result is None:
+            task = asyncio.create_task(self._resolve_in_background(dict(address), address_id))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+            return fallback
+        return result.get("coverageCode") or fallback
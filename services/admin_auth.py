@@ -0,0 +1,11 @@
+import os
+import secrets
+from fastapi import Header, HTTPException
+
+
+def require_admin(x_admin_token: str | None = Header(None)):
+    expected = os.getenv("ADMIN_API_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=503, detail="ADMIN_API_TOKEN no está configurado en el servidor.")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, expected):
+        raise HTTPException(status_code=403, detail="Token de administrador inválido.")
@@ -0,0 +1,296 @@
+import asyncio
+import codecs
+import csv
+import datetime
+import io
+import json
+import random
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from firebase_admin import firestore
+from pydantic import ValidationError
+
+from schemas import ProductImportRow
+
+FIRESTORE_BATCH_LIMIT = 500
+DEFAULT_MAX_IN_FLIGHT = 4
+EXPORT_FIELDS = ["id", "name", "price", "stock", "description", "imageUrl", "category"]
+SUPPORTED_FORMATS = ("csv", "ndjson")
+
+
+class BatchWriter:
+    # Agrupa escrituras en batches de hasta 500 operaciones y mantiene varios commits
+    # en paralelo. Cuando hay max_in_flight commits pendientes, set() espera, lo que
+    # mantiene la memoria acotada aunque el origen sea muy grande.
+    def __init__(self, db: firestore.Client, batch_size: int = FIRESTORE_BATCH_LIMIT,
+                 max_in_flight: int = DEFAULT_MAX_IN_FLIGHT):
+        self.db = db
+        self.batch_size = min(batch_size, FIRESTORE_BATCH_LIMIT)
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._tasks: set = set()
+        self._batch = None
+        self._pending: List[Any] = []
+        self.results: List[Dict[str, Any]] = []
+
+    async def set(self, ref, data: Dict[str, Any], merge: bool = False, tag: Any = None):
+        if self._batch is None:
+            self._batch = self.db.batch()
+        self._batch.set(ref, data, merge=merge)
+        self._pending.append(tag)
+        if len(self._pending) >= self.batch_size:
+            await self._commit_current()
+
+    async def _commit_current(self):
+        batch, tags = self._batch, self._pending
+        self._batch, self._pending = None, []
+        await self._semaphore.acquire()
+        task = asyncio.create_task(self._commit(batch, tags))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _commit(self, batch, tags: List[Any]):
+        try:
+            await asyncio.to_thread(batch.commit)
+            self.results.append({"ok": True, "tags": tags})
+        except Exception as e:
+            self.results.append({"ok": False, "tags": tags, "error": str(e)})
+        finally:
+            self._semaphore.release()
+
+    def drain_results(self) -> List[Dict[str, Any]]:
+        results, self.results = self.results, []
+        return results
+
+    async def flush(self):
+        if self._pending:
+            await self._commit_current()
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks))
+
+
+async def aiter_lines(chunks: AsyncIterator[bytes], encoding: str = "utf-8") -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+
+async def aiter_sync(lines: Iterable[str]) -> AsyncIterator[str]:
+    for line in lines:
+        yield line.rstrip("\r\n")
+
+
+async def _parse_rows(lines: AsyncIterator[str], fmt: str) -> AsyncIterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]:
+    header: Optional[List[str]] = None
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        if line_number == 1:
+            # Las exportaciones de Excel agregan BOM; sin quitarlo la columna "id" no se reconoce.
+            line = line.lstrip("\ufeff")
+        if not line.strip():
+            continue
+        if fmt == "ndjson":
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_number, None, f"JSON inválido: {e}"
+                continue
+            if not isinstance(row, dict):
+                yield line_number, None, "Se esperaba un objeto JSON por línea."
+                continue
+            yield line_number, row, None
+        else:
+            # Una fila CSV por línea: no se admiten saltos de línea dentro de campos.
+            values = next(csv.reader([line]))
+            if header is None:
+                header = [h.strip() for h in values]
+                continue
+            if len(values) != len(header):
+                yield line_number, None, f"Se esperaban {len(header)} columnas y llegaron {len(values)}."
+                continue
+            yield line_number, {k: (v if v != "" else None) for k, v in zip(header, values)}, None
+
+
+def _validation_message(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors())
+
+
+async def _validated_rows(lines: AsyncIterator[str], fmt: str) -> AsyncIterator[Tuple[int, Optional[ProductImportRow], Optional[str]]]:
+    async for line_number, raw, error in _parse_rows(lines, fmt):
+        row = None
+        if error is None:
+            try:
+                # Una celda vacía significa "sin valor": se usa el default o no se toca el campo.
+                row = ProductImportRow(**{k: v for k, v in raw.items() if v is not None})
+            except ValidationError as e:
+                error = _validation_message(e)
+        yield line_number, row, error
+
+
+async def _import_via_repository(repository, lines: AsyncIterator[str], fmt: str, dry_run: bool,
+                                 batch_size: int = FIRESTORE_BATCH_LIMIT) -> AsyncIterator[Dict[str, Any]]:
+    # Catálogo fuera de Firestore: cada lote va en un solo upsert_products y los ids de
+    # los productos nuevos se informan cuando el lote queda guardado.
+    summary = {"type": "summary", "valid": 0, "invalid": 0, "written": 0, "failed": 0, "dry_run": dry_run}
+    pending: List[Tuple[int, Dict[str, Any]]] = []
+
+    async def flush():
+        batch, pending[:] = list(pending), []
+        tags = [line_number for line_number, _ in batch]
+        report = {"type": "batch", "lines": [tags[0], tags[-1]], "count": len(tags)}
+        try:
+            ids = await repository.upsert_products([data for _, data in batch])
+        except Exception as e:
+            summary["failed"] += len(batch)
+            return [{**report, "ok": False, "error": str(e)}]
+        summary["written"] += len(batch)
+        lines_out = [{"type": "line", "line": n, "ok": True, "id": product_id} for n, product_id in zip(tags, ids)]
+        return lines_out + [{**report, "ok": True}]
+
+    async for line_number, row, error in _validated_rows(lines, fmt):
+        if error is not None:
+            summary["invalid"] += 1
+            yield {"type": "line", "line": line_number, "ok": False, "error": error}
+            continue
+        summary["valid"] += 1
+        if dry_run:
+            yield {"type": "line", "line": line_number, "ok": True, "id": row.id}
+            continue
+        pending.append((line_number, row.dict(exclude_unset=True)))
+        if len(pending) >= batch_size:
+            for report in await flush():
+                yield report
+    if pending:
+        for report in await flush():
+            yield report
+    yield summary
+
+
+async def import_products(db: firestore.Client, lines: AsyncIterator[str], fmt: str = "ndjson",
+                          dry_run: bool = False, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                          repository=None) -> AsyncIterator[Dict[str, Any]]:
+    if fmt not in SUPPORTED_FORMATS:
+        raise ValueError(f"Formato no soportado: {fmt}")
+    if repository is not None and not repository.firestore_stock:
+        async for report in _import_via_repository(repository, lines, fmt, dry_run):
+            yield report
+        return
+
+    products_ref = db.collection('products')
+    writer = BatchWriter(db, max_in_flight=max_in_flight)
+    summary = {"type": "summary", "valid": 0, "invalid": 0, "written": 0, "failed": 0, "dry_run": dry_run}
+
+    def batch_reports():
+        for result in writer.drain_results():
+            tags = result["tags"]
+            report = {"type": "batch", "ok": result["ok"], "lines": [tags[0], tags[-1]], "count": len(tags)}
+            if result["ok"]:
+                summary["written"] += len(tags)
+            else:
+                summary["failed"] += len(tags)
+                report["error"] = result["error"]
+            yield report
+
+    async for line_number, row, error in _validated_rows(lines, fmt):
+        if error is not None:
+            summary["invalid"] += 1
+            yield {"type": "line", "line": line_number, "ok": False, "error": error}
+            continue
+
+        summary["valid"] += 1
+        doc_ref = products_ref.document(row.id) if row.id else products_ref.document()
+        yield {"type": "line", "line": line_number, "ok": True, "id": doc_ref.id}
+        if not dry_run:
+            # Solo los campos presentes en la fila: con merge=True un default (stock=0)
+            # pisaría el valor existente del producto.
+            data = row.dict(exclude={"id"}, exclude_unset=True)
+            await writer.set(doc_ref, data, merge=True, tag=line_number)
+            for report in batch_reports():
+                yield report
+
+    await writer.flush()
+    for report in batch_reports():
+        yield report
+    yield summary
+
+
+def _csv_line(values: List[Any]) -> str:
+    out = io.StringIO()
+    csv.writer(out, lineterminator="\n").writerow(values)
+    return out.getvalue()
+
+
+def export_products(db: firestore.Client, fmt: str = "ndjson") -> Iterator[str]:
+    if fmt not in SUPPORTED_FORMATS:
+        raise ValueError(f"Formato no soportado: {fmt}")
+    if fmt == "csv":
+        yield _csv_line(EXPORT_FIELDS)
+    # Solo los campos exportables: sin la proyección cada documento traería 'imagen'.
+    stored_fields = [f for f in EXPORT_FIELDS if f != "id"]
+    for doc in db.collection('products').select(stored_fields).stream():
+        product = doc.to_dict()
+        product['id'] = doc.id
+        if fmt == "csv":
+            yield _csv_line(["" if product.get(f) is None else product.get(f) for f in EXPORT_FIELDS])
+        else:
+            yield json.dumps({f: product.get(f) for f in EXPORT_FIELDS}, ensure_ascii=False, default=str) + "\n"
+
+
+async def export_repository_products(repository, fmt: str = "ndjson") -> AsyncIterator[str]:
+    # Para catálogos fuera de Firestore; solo EXPORT_FIELDS, igual que el CSV.
+    if fmt not in SUPPORTED_FORMATS:
+        raise ValueError(f"Formato no soportado: {fmt}")
+    if fmt == "csv":
+        yield _csv_line(EXPORT_FIELDS)
+    for product in await repository.list_products():
+        if fmt == "csv":
+            yield _csv_line(["" if product.get(f) is None else product.get(f) for f in EXPORT_FIELDS])
+        else:
+            yield json.dumps({f: product.get(f) for f in EXPORT_FIELDS}, ensure_ascii=False, default=str) + "\n"
+
+
+async def seed_orders(db: firestore.Client, count: int, user_ids: Optional[List[str]] = None,
+                      max_in_flight: int = DEFAULT_MAX_IN_FLIGHT) -> Dict[str, Any]:
+    # Genera órdenes sintéticas para pruebas de carga usando productos reales del catálogo.
+    products = []
+    for doc in db.collection('products').limit(200).stream():
+        data = doc.to_dict()
+        products.append({"id": doc.id, "name": data.get('name', doc.id), "price": float(data.get('price') or 1000)})
+    if not products:
+        products = [{"id": f"seed-{i}", "name": f"Producto {i}", "price": float(1000 * (i + 1))} for i in range(10)]
+    user_ids = user_ids or [f"seed-user-{i}" for i in range(50)]
+
+    orders_ref = db.collection('orders')
+    writer = BatchWriter(db, max_in_flight=max_in_flight)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    for n in range(count):
+        items = []
+        for product in random.sample(products, k=min(len(products), random.randint(1, 4))):
+            items.append({**product, "quantity": random.randint(1, 3)})
+        user_id = random.choice(user_ids)
+        created_at = now - datetime.timedelta(minutes=random.randint(0, 60 * 24 * 90))
+        await writer.set(orders_ref.document(), {
+            "userId": user_id,
+            "userEmail": f"{user_id}@example.com",
+            "userName": user_id,
+            "items": items,
+            "totalAmount": sum(i["price"] * i["quantity"] for i in items),
+            "status": "seed",
+            "createdAt": created_at,
+            "transbank": {"transaction_date": created_at},
+        }, tag=n)
+    await writer.flush()
+
+    results = writer.drain_results()
+    return {
+        "requested": count,
+        "written": sum(len(r["tags"]) for r in results if r["ok"]),
+        "errors": [r["error"] for r in results if not r["ok"]],
+    }
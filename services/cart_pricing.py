@@ -0,0 +1,54 @@
+from typing import Dict, Iterable, Tuple
+
+from repositories.products import ProductRepository
+from schemas import CartLineResult, CartValidationResponse
+
+NOT_FOUND = "not_found"
+INSUFFICIENT_STOCK = "insufficient_stock"
+
+
+def _merge_lines(lines: Iterable[Tuple[str, int]]) -> Dict[str, int]:
+    quantities: Dict[str, int] = {}
+    for product_id, quantity in lines:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+async def price_cart(repository: ProductRepository, lines: Iterable[Tuple[str, int]]) -> CartValidationResponse:
+    # Una sola lectura en lote para todo el carrito; precios y stock siempre del servidor.
+    quantities = _merge_lines(lines)
+    products = await repository.get_products(quantities.keys())
+
+    results = []
+    subtotal = 0.0
+    item_count = 0
+    for product_id, quantity in quantities.items():
+        product = products.get(product_id)
+        if product is None:
+            results.append(CartLineResult(id=product_id, quantity=quantity, available=False, error=NOT_FOUND))
+            continue
+
+        unit_price = float(product.get('price') or 0)
+        stock = int(product.get('stock') or 0)
+        available = stock >= quantity
+        line_total = unit_price * quantity
+        if available:
+            subtotal += line_total
+            item_count += quantity
+        results.append(CartLineResult(
+            id=product_id,
+            name=product.get('name'),
+            quantity=quantity,
+            unitPrice=unit_price,
+            lineTotal=line_total,
+            stock=stock,
+            available=available,
+            error=None if available else INSUFFICIENT_STOCK,
+        ))
+
+    return CartValidationResponse(
+        valid=all(r.available for r in results) and bool(results),
+        items=results,
+        itemCount=item_count,
+        subtotal=subtotal,
+    )
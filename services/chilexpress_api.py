@@ -2,10 +2,17 @@ import httpx
 from fastapi import HTTPException
 import json
 from urllib.parse import urljoin 
+from services.shared_cache import SharedCache
+from services.profiling import span
+
+REGIONS_TTL = 24 * 3600
+COVERAGE_AREAS_TTL = 24 * 3600
+OFFICES_TTL = 3600
 
 
 class ChilexpressApiService:
-    def __init__(self, config: dict):
+    def __init__(self, config: dict, cache: SharedCache = None):
+        self.cache = cache
         self.coberturas_base_url = config.get("COBERTURAS_BASE_URL")
         self.cotizaciones_base_url = config.get("COTIZACIONES_BASE_URL")
         self.envios_base_url = config.get("ENVIOS_BASE_URL")
@@ -51,7 +58,7 @@ class ChilexpressApiService:
         print(f"-------------------------------------\n")
 
         try:
-            async with httpx.AsyncClient() as client:
+            async with span(f"chilexpress {method} {url}"), httpx.AsyncClient() as client:
                 if method == "GET":
                     response = await client.get(url, headers=headers, params=params)
                 elif method == "POST":
@@ -90,14 +97,23 @@ class ChilexpressApiService:
             )
 
 
+    async def _cached_request(self, cache_key: str, ttl: float, method: str, url: str, headers: dict, **kwargs):
+        if self.cache is None:
+            return await self._make_request(method, url, headers, **kwargs)
+        return await self.cache.get_or_load(
+            f"chilexpress:{cache_key}", ttl, lambda: self._make_request(method, url, headers, **kwargs)
+        )
+
     async def get_regions(self):
         full_url = f"{self.coberturas_base_url}/regions"
-        return await self._make_request("GET", full_url, self.headers_coberturas)
+        return await self._cached_request("regions", REGIONS_TTL, "GET", full_url, self.headers_coberturas)
 
     async def get_coverage_areas(self, region_code: str, type: int = 1):
         params = {"RegionCode": region_code, "type": type}
         full_url = f"{self.coberturas_base_url}/coverage-areas"
-        return await self._make_request("GET", full_url, self.headers_coberturas, params=params)
+        return await self._cached_request(
+            f"coverage-areas:{region_code}:{type}", COVERAGE_AREAS_TTL, "GET", full_url, self.headers_coberturas, params=params
+        )
 
     async def search_streets(self, county_name: str, street_name: str):
         json_data = {"countyName": county_name, "streetName": street_name}
@@ -115,7 +131,9 @@ class ChilexpressApiService:
     async def get_delivery_offices(self, region_code: str, county_name: str):
         params = {"Type": 0, "RegionCode": region_code, "CountyName": county_name}
         full_url = f"{self.coberturas_base_url}/offices"
-        return await self._make_request("GET", full_url, self.headers_coberturas, params=params)
+        return await self._cached_request(
+            f"offices:{region_code}:{county_name.lower()}", OFFICES_TTL, "GET", full_url, self.headers_coberturas, params=params
+        )
 
     async def quote_shipping(self, quote_body: dict):
         full_url = f"{self.cotizaciones_base_url}/rates/courier"
@@ -0,0 +1,228 @@
+import asyncio
+import datetime
+import json
+import os
+from typing import Any, Dict, List, Optional, Set
+
+from firebase_admin import firestore
+
+HEARTBEAT_SECONDS = float(os.getenv("ORDER_EVENTS_HEARTBEAT_SECONDS", "20"))
+ACTIVE_ORDER_DAYS = int(os.getenv("ORDER_EVENTS_ACTIVE_DAYS", "30"))
+REFRESH_SECONDS = float(os.getenv("ORDER_EVENTS_REFRESH_SECONDS", "3600"))
+MAX_PENDING_PER_SUBSCRIBER = 100
+RECONNECT_MS = 3000
+
+
+def format_event(event_type: str, data: Dict[str, Any]) -> str:
+    return f"event: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def order_state(order_id: str, order: Dict[str, Any]) -> Dict[str, Any]:
+    # Solo lo que el frontend necesita para saber si una orden cambió de estado.
+    shipping = order.get('shipping') or {}
+    details = (((shipping.get('chilexpressResponse') or {}).get('data') or {}).get('detail')) or [{}]
+    first_detail = details[0] if isinstance(details[0], dict) else {}
+    tracking = shipping.get('tracking') or {}
+    return {
+        "orderId": order_id,
+        "status": order.get('status'),
+        "trackingNumber": first_detail.get('transportOrderNumber'),
+        "trackingStatus": tracking.get('status') or tracking.get('statusDescription'),
+        "trackingEvents": len(tracking.get('events') or []),
+    }
+
+
+def is_delivered(state: Dict[str, Any]) -> bool:
+    # Chilexpress informa "ENTREGADO" (o "Entregado") en el estado del seguimiento.
+    return state.get("status") == "delivered" or "ENTREGAD" in str(state.get("trackingStatus") or "").upper()
+
+
+class OrderSubscriber:
+    # Los eventos se coalescen por orden: si el cliente lee lento solo recibe el último
+    # estado de cada orden, así la memoria por conexión queda acotada. Si aun así se
+    # supera el límite, se descarta todo y se pide al cliente que recargue /orders.
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.wake = asyncio.Event()
+        self.pending: Dict[str, Dict[str, Any]] = {}
+        self.heartbeat = False
+        self.resync = False
+
+    def push(self, event: Dict[str, Any]):
+        self.pending.pop(event["orderId"], None)
+        self.pending[event["orderId"]] = event
+        if len(self.pending) > MAX_PENDING_PER_SUBSCRIBER:
+            self.pending.clear()
+            self.resync = True
+        self.wake.set()
+
+    def beat(self):
+        self.heartbeat = True
+        self.wake.set()
+
+    def drain(self) -> List[str]:
+        messages = []
+        if self.resync:
+            messages.append(format_event("resync", {}))
+            self.resync = False
+        for event in self.pending.values():
+            messages.append(format_event("order", event))
+        self.pending.clear()
+        if self.heartbeat and not messages:
+            messages.append(": ping\n\n")
+        self.heartbeat = False
+        self.wake.clear()
+        return messages
+
+
+class OrderEventHub:
+    # Un único listener de Firestore por worker para todas las conexiones SSE. El
+    # callback llega en un hilo del SDK y se reenvía al event loop; cada conexión es
+    # solo una corrutina esperando su asyncio.Event, sin timers propios: un único
+    # latido periódico despierta a todas.
+    def __init__(self, heartbeat_seconds: float = HEARTBEAT_SECONDS, refresh_seconds: float = REFRESH_SECONDS):
+        self.heartbeat_seconds = heartbeat_seconds
+        self.refresh_seconds = refresh_seconds
+        self._subscribers: Dict[str, Set[OrderSubscriber]] = {}
+        self._states: Dict[str, Dict[str, Any]] = {}
+        self._user_orders: Dict[str, Set[str]] = {}
+        self._order_users: Dict[str, str] = {}
+        self._created: Dict[str, datetime.datetime] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._watch = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    @property
+    def connections(self) -> int:
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def start(self, db: firestore.Client, active_days: int = ACTIVE_ORDER_DAYS):
+        self._loop = asyncio.get_running_loop()
+        self._watch = self._listen(db, self._cutoff(active_days))
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        self._refresh_task = asyncio.create_task(self._refresh(db, active_days))
+
+    def close(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+        for task in (self._heartbeat_task, self._refresh_task):
+            if task is not None:
+                task.cancel()
+        self._heartbeat_task = None
+        self._refresh_task = None
+
+    @staticmethod
+    def _cutoff(active_days: int) -> datetime.datetime:
+        return datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=active_days)
+
+    def _listen(self, db: firestore.Client, cutoff: datetime.datetime):
+        # Cada listener tiene su propio primer snapshot, que solo fija el estado base.
+        baseline = [True]
+
+        def on_snapshot(col_snapshot, changes, read_time):
+            updates = []
+            for change in changes:
+                order = change.document.to_dict() or {}
+                removed = change.type.name == 'REMOVED'
+                updates.append((order.get('userId'), order_state(change.document.id, order), order.get('createdAt'), removed))
+            is_baseline, baseline[0] = baseline[0], False
+            self._loop.call_soon_threadsafe(self._apply, updates, is_baseline)
+
+        return db.collection('orders').where('createdAt', '>=', cutoff).on_snapshot(on_snapshot)
+
+    async def _refresh(self, db: firestore.Client, active_days: int):
+        # La consulta fija su corte al crearse: se vuelve a abrir con un corte nuevo para
+        # que la ventana avance, y se olvidan las órdenes que quedaron fuera.
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                cutoff = self._cutoff(active_days)
+                watch = await asyncio.to_thread(self._listen, db, cutoff)
+                previous, self._watch = self._watch, watch
+                if previous is not None:
+                    await asyncio.to_thread(previous.unsubscribe)
+                self._prune(cutoff)
+            except Exception as e:
+                print(f"Error al renovar el listener de órdenes: {e}")
+
+    def _prune(self, cutoff: datetime.datetime):
+        for order_id, created_at in list(self._created.items()):
+            if created_at < cutoff:
+                self._evict(order_id)
+
+    def _evict(self, order_id: str):
+        self._states.pop(order_id, None)
+        self._created.pop(order_id, None)
+        user_id = self._order_users.pop(order_id, None)
+        orders = self._user_orders.get(user_id)
+        if orders is not None:
+            orders.discard(order_id)
+            if not orders:
+                del self._user_orders[user_id]
+
+    def _apply(self, updates: List[tuple], baseline: bool):
+        for user_id, state, created_at, removed in updates:
+            order_id = state["orderId"]
+            if removed:
+                self._evict(order_id)
+                continue
+            if not user_id or self._states.get(order_id) == state:
+                continue
+            # En el snapshot base de un listener renovado solo se publica lo que cambió
+            # de órdenes ya conocidas; el resto es estado que el cliente ya tiene.
+            publish = not baseline or order_id in self._states
+            if is_delivered(state):
+                # Una orden entregada ya no cambia: se publica su último estado y se olvida.
+                self._evict(order_id)
+            else:
+                self._states[order_id] = state
+                self._order_users[order_id] = user_id
+                self._user_orders.setdefault(user_id, set()).add(order_id)
+                if isinstance(created_at, datetime.datetime):
+                    self._created[order_id] = created_at
+            if publish:
+                self.publish(user_id, state)
+
+    def publish(self, user_id: str, event: Dict[str, Any]):
+        # También sirve como bus interno para cambios que no pasan por Firestore.
+        for subscriber in self._subscribers.get(user_id, ()):
+            subscriber.push(event)
+
+    def current_states(self, user_id: str) -> List[Dict[str, Any]]:
+        return [self._states[order_id] for order_id in self._user_orders.get(user_id, ())]
+
+    def subscribe(self, user_id: str) -> OrderSubscriber:
+        subscriber = OrderSubscriber(user_id)
+        self._subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: OrderSubscriber):
+        subscribers = self._subscribers.get(subscriber.user_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self._subscribers[subscriber.user_id]
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            for subscribers in list(self._subscribers.values()):
+                for subscriber in subscribers:
+                    subscriber.beat()
+
+    async def stream(self, user_id: str):
+        subscriber = self.subscribe(user_id)
+        try:
+            yield f"retry: {RECONNECT_MS}\n\n"
+            # Estado actual al conectar: el cliente no necesita consultar /orders antes.
+            for state in self.current_states(user_id):
+                yield format_event("order", state)
+            while True:
+                await subscriber.wake.wait()
+                for message in subscriber.drain():
+                    yield message
+        finally:
+            self.unsubscribe(subscriber)
@@ -0,0 +1,91 @@
+import asyncio
+import io
+import os
+import tempfile
+from typing import Optional, Tuple
+
+from repositories.products import ProductRepository
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+THUMBNAIL_SIZES = (128, 256, 512)
+VERSION_LENGTH = 16
+
+_MAGIC_TYPES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+def sniff_media_type(head: bytes) -> str:
+    for magic, media_type in _MAGIC_TYPES:
+        if head.startswith(magic):
+            return media_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+class ProductImageStore:
+    # Materializa las imágenes en disco con nombre por hash de contenido para que
+    # se sirvan con FileResponse (sendfile + Range) y se cacheen como inmutables.
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self._versions: dict = {}
+
+    def _path(self, version: str, size: Optional[int]) -> str:
+        name = version if size is None else f"{version}_{size}"
+        return os.path.join(self.cache_dir, name)
+
+    def _write_atomic(self, path: str, data: bytes):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _make_thumbnail(self, source_path: str, size: int) -> bytes:
+        with Image.open(source_path) as img:
+            img.thumbnail((size, size))
+            out = io.BytesIO()
+            if img.mode in ("RGBA", "LA", "P"):
+                img.save(out, format="PNG", optimize=True)
+            else:
+                img.convert("RGB").save(out, format="JPEG", quality=85, optimize=True)
+            return out.getvalue()
+
+    async def get(self, repository: ProductRepository, product_id: str, size: Optional[int] = None,
+                  version: Optional[str] = None) -> Optional[Tuple[str, str, str]]:
+        # Retorna (ruta, media_type, versión) o None si el producto no tiene imagen.
+        if Image is None:
+            size = None
+
+        # Con una versión conocida no se consulta el repositorio; sin versión se
+        # revalida siempre para detectar cambios de imagen.
+        current = self._versions.get(product_id)
+        if not (version and version == current and os.path.exists(self._path(current, None))):
+            image = await repository.get_product_image(product_id)
+            if image is None:
+                self._versions.pop(product_id, None)
+                return None
+            data, image_hash = image
+            current = image_hash[:VERSION_LENGTH]
+            if not os.path.exists(self._path(current, None)):
+                await asyncio.to_thread(self._write_atomic, self._path(current, None), data)
+            self._versions[product_id] = current
+
+        path = self._path(current, size)
+        if size is not None and not os.path.exists(path):
+            thumbnail = await asyncio.to_thread(self._make_thumbnail, self._path(current, None), size)
+            await asyncio.to_thread(self._write_atomic, path, thumbnail)
+        return self._finish(path, current)
+
+    def _finish(self, path: str, version: str) -> Tuple[str, str, str]:
+        with open(path, "rb") as f:
+            media_type = sniff_media_type(f.read(12))
+        return path, media_type, version
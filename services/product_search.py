@@ -0,0 +1,400 @@
+import asyncio
+import bisect
+import math
+import re
+import threading
+import unicodedata
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from repositories.products import PRODUCT_FIELDS, ProductRepository, FirestoreProductRepository
+from services.stock_reservations import ROLLUPS_COLLECTION
+
+NAME_WEIGHT = 3.0
+DESCRIPTION_WEIGHT = 1.0
+MAX_PREFIX_EXPANSIONS = 50
+RANK_REFRESH_SECONDS = 5.0
+PRICE_BUCKETS: List[Tuple[float, Optional[float]]] = [
+    (0, 5000), (5000, 10000), (10000, 20000), (20000, 50000), (50000, None),
+]
+_BUCKET_EDGES = np.array([low for low, _ in PRICE_BUCKETS], dtype=np.float64)
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def fold(text: str) -> str:
+    # "Cañón Eléctrico" -> "canon electrico"
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(fold(text))
+
+
+def _bucket_label(low: float, high: Optional[float]) -> str:
+    return f"{int(low)}-{int(high)}" if high is not None else f"{int(low)}+"
+
+
+def _category_of(product: Dict[str, Any]) -> Optional[str]:
+    category = product.get('category', product.get('categoryId'))
+    return None if category is None else str(category)
+
+
+class ProductSearchIndex:
+    # Las postings viven en dicts (baratos de actualizar uno a uno) y se compilan
+    # de forma perezosa a arrays NumPy por término; la consulta trabaja con vectores
+    # densos de puntaje sobre todos los slots, así que su costo no depende de Python
+    # por documento coincidente. El orden alfabético se recalcula fuera del lock y se
+    # reemplaza de una vez, así una consulta nunca espera a que se ordene el catálogo.
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._watch = None
+        self._rollup_watch = None
+        # Stock total de los productos con shards (stock_rollups). Vive fuera de _reset
+        # porque lo alimenta su propio listener y debe sobrevivir a build().
+        self._rollups: Dict[str, Any] = {}
+        self._reset()
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    # --- Mantenimiento -------------------------------------------------
+
+    def _reset(self):
+        self._slots: Dict[str, int] = {}
+        self._free_slots: List[int] = []
+        self._products: List[Optional[Dict[str, Any]]] = []
+        self._doc_terms: List[Dict[str, float]] = []
+        self._sort_keys: List[str] = []
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._compiled: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._vocab: List[str] = []
+        self._vocab_dirty = False
+        self._category_codes: Dict[str, int] = {}
+        self._category_names: List[str] = []
+        self._alive = np.zeros(0, dtype=bool)
+        self._prices = np.zeros(0, dtype=np.float64)
+        self._categories = np.zeros(0, dtype=np.int32)
+        self._buckets = np.zeros(0, dtype=np.int32)
+        self._rank = np.zeros(0, dtype=np.int64)
+        self._rank_dirty = False
+        self._rank_version = 0
+
+    def build(self, products: Iterable[Dict[str, Any]]):
+        # Se arma en un índice aparte y se adopta al final: las consultas siguen
+        # respondiendo con el índice anterior mientras tanto.
+        fresh = ProductSearchIndex()
+        fresh._rollups = self._rollups
+        for product in products:
+            fresh._upsert(product)
+        fresh.rebuild_ranks()
+        state = {k: v for k, v in fresh.__dict__.items() if k not in ('_lock', '_watch', '_rollup_watch', '_rollups')}
+        with self._lock:
+            self.__dict__.update(state)
+
+    def upsert(self, product: Dict[str, Any]):
+        with self._lock:
+            self._upsert(product)
+
+    def remove(self, product_id: str):
+        with self._lock:
+            slot = self._slots.pop(product_id, None)
+            if slot is None:
+                return
+            self._unindex(slot)
+            self._products[slot] = None
+            self._alive[slot] = False
+            self._free_slots.append(slot)
+
+    def set_rollup(self, product_id: str, stock: Optional[Any]):
+        # None borra el total (el producto dejó de tener shards).
+        with self._lock:
+            if stock is None:
+                self._rollups.pop(product_id, None)
+                return
+            self._rollups[product_id] = stock
+            slot = self._slots.get(product_id)
+            if slot is not None:
+                self._apply_rollup(self._products[slot])
+
+    def _apply_rollup(self, product: Dict[str, Any]):
+        # En los productos con shards el stock del documento queda desactualizado.
+        if int(product.get('stockShards') or 0) > 0 and product['id'] in self._rollups:
+            product['stock'] = self._rollups[product['id']]
+
+    def _ensure_capacity(self, size: int):
+        capacity = len(self._alive)
+        if size <= capacity:
+            return
+        new_capacity = max(size, capacity * 2, 1024)
+        grow = new_capacity - capacity
+        self._alive = np.concatenate([self._alive, np.zeros(grow, dtype=bool)])
+        self._prices = np.concatenate([self._prices, np.zeros(grow, dtype=np.float64)])
+        self._categories = np.concatenate([self._categories, np.full(grow, -1, dtype=np.int32)])
+        self._buckets = np.concatenate([self._buckets, np.full(grow, -1, dtype=np.int32)])
+        self._rank = np.concatenate([self._rank, np.zeros(grow, dtype=np.int64)])
+
+    def _category_code(self, category: Optional[str]) -> int:
+        if category is None:
+            return -1
+        code = self._category_codes.get(category)
+        if code is None:
+            code = self._category_codes[category] = len(self._category_names)
+            self._category_names.append(category)
+        return code
+
+    def _upsert(self, product: Dict[str, Any]):
+        product_id = str(product['id'])
+        slot = self._slots.get(product_id)
+        if slot is None:
+            if self._free_slots:
+                slot = self._free_slots.pop()
+            else:
+                slot = len(self._products)
+                self._products.append(None)
+                self._doc_terms.append({})
+                self._sort_keys.append('')
+                self._ensure_capacity(slot + 1)
+            self._slots[product_id] = slot
+            # Hasta el próximo rebuild_ranks los productos nuevos quedan al final.
+            self._rank[slot] = len(self._rank)
+            self._sort_keys[slot] = None
+        else:
+            self._unindex(slot)
+
+        terms: Dict[str, float] = {}
+        for token in tokenize(product.get('name', '')):
+            terms[token] = terms.get(token, 0.0) + NAME_WEIGHT
+        for token in tokenize(product.get('description', '')):
+            terms[token] = terms.get(token, 0.0) + DESCRIPTION_WEIGHT
+        for token, weight in terms.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                self._vocab_dirty = True
+            postings[slot] = weight
+            self._compiled.pop(token, None)
+
+        self._doc_terms[slot] = terms
+        self._products[slot] = {k: v for k, v in product.items() if k != 'imagen'}
+        self._products[slot]['id'] = product_id
+        self._apply_rollup(self._products[slot])
+        self._alive[slot] = True
+        self._prices[slot] = float(product.get('price') or 0)
+        self._buckets[slot] = int(np.searchsorted(_BUCKET_EDGES, self._prices[slot], side='right')) - 1
+        self._categories[slot] = self._category_code(_category_of(product))
+        # Solo un cambio de nombre altera el orden; precio o stock no.
+        sort_key = fold(product.get('name', ''))
+        if self._sort_keys[slot] != sort_key:
+            self._sort_keys[slot] = sort_key
+            self._rank_version += 1
+            self._rank_dirty = True
+
+    def _unindex(self, slot: int):
+        for token in self._doc_terms[slot]:
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(slot, None)
+            self._compiled.pop(token, None)
+            if not postings:
+                del self._postings[token]
+                self._vocab_dirty = True
+        self._doc_terms[slot] = {}
+
+    # --- Consulta ------------------------------------------------------
+
+    def _expand_prefix(self, prefix: str) -> List[str]:
+        if self._vocab_dirty:
+            self._vocab = sorted(self._postings)
+            self._vocab_dirty = False
+        start = bisect.bisect_left(self._vocab, prefix)
+        terms = []
+        for term in self._vocab[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+        return terms
+
+    def _postings_array(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        compiled = self._compiled.get(term)
+        if compiled is None:
+            postings = self._postings.get(term)
+            if not postings:
+                return None
+            compiled = (
+                np.fromiter(postings.keys(), dtype=np.int64, count=len(postings)),
+                np.fromiter(postings.values(), dtype=np.float32, count=len(postings)),
+            )
+            self._compiled[term] = compiled
+        return compiled
+
+    def rebuild_ranks(self):
+        # Orden alfabético (plegado) para desempates y para la consulta vacía. Bajo el
+        # lock solo se copian las claves; el ordenamiento corre sin bloquear consultas
+        # ni al listener, y el resultado se reemplaza entero.
+        with self._lock:
+            version = self._rank_version
+            slots = np.fromiter(self._slots.values(), dtype=np.int64, count=len(self._slots))
+            keys = np.array([self._sort_keys[slot] for slot in slots.tolist()], dtype=str)
+            capacity = len(self._rank)
+        rank = np.full(capacity, capacity, dtype=np.int64)
+        rank[slots[np.argsort(keys, kind='stable')]] = np.arange(len(slots))
+        with self._lock:
+            if len(self._rank) > capacity:
+                rank = np.concatenate([rank, self._rank[capacity:]])
+            self._rank = rank
+            self._rank_dirty = self._rank_version != version
+
+    def _match(self, tokens: List[str], size: int) -> Tuple[np.ndarray, np.ndarray]:
+        total_docs = max(len(self._slots), 1)
+        scores = np.zeros(size, dtype=np.float32)
+        mask = self._alive[:size].copy()
+        # Cada token es un grupo de términos (el último admite prefijo). Semántica AND.
+        for position, token in enumerate(tokens):
+            terms = self._expand_prefix(token) if position == len(tokens) - 1 else [token]
+            group = np.zeros(size, dtype=np.float32)
+            for term in terms:
+                compiled = self._postings_array(term)
+                if compiled is None:
+                    continue
+                slots, weights = compiled
+                idf = math.log(1 + total_docs / len(slots))
+                # Coincidencia exacta pesa más que una por prefijo.
+                boost = 1.0 if term == token else 0.7
+                group[slots] = np.maximum(group[slots], weights * np.float32(idf * boost))
+            mask &= group > 0
+            if not mask.any():
+                break
+            scores += group
+        return scores, mask
+
+    def search(self, query: str = "", category: Optional[str] = None, min_price: Optional[float] = None,
+               max_price: Optional[float] = None, page: int = 1, page_size: int = 20) -> Dict[str, Any]:
+        tokens = tokenize(query)
+        page = max(page, 1)
+        with self._lock:
+            size = len(self._products)
+            if tokens:
+                scores, mask = self._match(tokens, size)
+            else:
+                scores, mask = np.zeros(size, dtype=np.float32), self._alive[:size].copy()
+
+            # Desde aquí se trabaja sobre los índices coincidentes, no sobre todo el catálogo.
+            matched = np.flatnonzero(mask)
+            categories = self._categories[matched]
+            buckets = self._buckets[matched]
+
+            # Las facetas se cuentan sobre el texto buscado, antes de aplicar filtros.
+            category_counts = np.bincount(categories[categories >= 0], minlength=len(self._category_names))
+            category_facets = {self._category_names[code]: int(count) for code, count in enumerate(category_counts) if count}
+            bucket_counts = np.bincount(buckets[buckets >= 0], minlength=len(PRICE_BUCKETS))
+            price_facets = {_bucket_label(low, high): int(bucket_counts[k]) for k, (low, high) in enumerate(PRICE_BUCKETS)}
+
+            keep = None
+            if category is not None:
+                keep = categories == self._category_codes.get(category, -2)
+            if min_price is not None or max_price is not None:
+                prices = self._prices[matched]
+                price_keep = np.ones(len(matched), dtype=bool)
+                if min_price is not None:
+                    price_keep &= prices >= min_price
+                if max_price is not None:
+                    price_keep &= prices <= max_price
+                keep = price_keep if keep is None else keep & price_keep
+            candidates = matched if keep is None else matched[keep]
+            total = len(candidates)
+            limit = page * page_size
+            ranks = self._rank[:size]
+            if tokens:
+                primary = -scores[candidates]
+            else:
+                primary = ranks[candidates].astype(np.float32)
+            if len(candidates) > limit:
+                top = np.argpartition(primary, limit - 1)[:limit]
+                candidates, primary = candidates[top], primary[top]
+            ordered = candidates[np.lexsort((ranks[candidates], primary))]
+
+            items = []
+            for slot in ordered[(page - 1) * page_size:limit]:
+                product = dict(self._products[slot])
+                product['score'] = round(float(scores[slot]), 4)
+                items.append(product)
+
+        return {
+            "query": query,
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "items": items,
+            "facets": {"category": category_facets, "price": price_facets},
+        }
+
+    # --- Sincronización --------------------------------------------------
+
+    def attach_firestore_listener(self, db, collection: str = 'products',
+                                  to_product: Optional[Callable[[Any], Dict[str, Any]]] = None,
+                                  field_paths: Optional[List[str]] = None):
+        # El primer snapshot trae todos los documentos como ADDED y construye el índice;
+        # los siguientes solo traen los cambios. field_paths limita los campos que se
+        # descargan (sin 'imagen', el índice no la usa).
+        first = [True]
+
+        def on_snapshot(col_snapshot, changes, read_time):
+            if first[0]:
+                first[0] = False
+                self.build(to_product(change.document) if to_product is not None
+                           else {**change.document.to_dict(), 'id': change.document.id}
+                           for change in changes if change.type.name != 'REMOVED')
+                return
+            with self._lock:
+                for change in changes:
+                    if change.type.name == 'REMOVED':
+                        self.remove(change.document.id)
+                    elif to_product is not None:
+                        self._upsert(to_product(change.document))
+                    else:
+                        self._upsert({**change.document.to_dict(), 'id': change.document.id})
+
+        query = db.collection(collection)
+        if field_paths:
+            query = query.select(field_paths)
+        self._watch = query.on_snapshot(on_snapshot)
+
+    def attach_rollup_listener(self, db):
+        def on_snapshot(col_snapshot, changes, read_time):
+            for change in changes:
+                if change.type.name == 'REMOVED':
+                    self.set_rollup(change.document.id, None)
+                else:
+                    self.set_rollup(change.document.id, (change.document.to_dict() or {}).get('stock'))
+
+        self._rollup_watch = db.collection(ROLLUPS_COLLECTION).on_snapshot(on_snapshot)
+
+    def close(self):
+        for watch in (self._watch, self._rollup_watch):
+            if watch is not None:
+                watch.unsubscribe()
+        self._watch = self._rollup_watch = None
+
+    async def keep_updated(self, repository: ProductRepository, refresh_seconds: float = 300):
+        if isinstance(repository, FirestoreProductRepository):
+            self.attach_rollup_listener(repository.db)
+            self.attach_firestore_listener(repository.db, repository.collection, repository.to_product, PRODUCT_FIELDS)
+            # Los cambios del listener se reordenan en segundo plano, como máximo cada
+            # RANK_REFRESH_SECONDS, para que una ráfaga de renombres no ordene el catálogo cada vez.
+            while True:
+                await asyncio.sleep(RANK_REFRESH_SECONDS)
+                if self._rank_dirty:
+                    try:
+                        await asyncio.to_thread(self.rebuild_ranks)
+                    except Exception as e:
+                        print(f"Error al reordenar el índice de búsqueda de productos: {e}")
+        while True:
+            try:
+                products = await repository.list_products()
+                await asyncio.to_thread(self.build, products)
+            except Exception as e:
+                print(f"Error al reconstruir el índice de búsqueda de productos: {e}")
+            await asyncio.sleep(refresh_seconds)
@@ -0,0 +1,228 @@
+import contextvars
+import itertools
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Dict, List, Optional
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("request_trace", default=None)
+_trace_ids = itertools.count(1)
+
+
+class RequestTrace:
+    def __init__(self, method: str, path: str, reason: str, thread_id: int):
+        self.id = f"{next(_trace_ids)}-{secrets.token_hex(4)}"
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.thread_id = thread_id
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.status_code: Optional[int] = None
+        self.spans: List[Dict[str, Any]] = []
+        self.stacks: Counter = Counter()
+        self.samples = 0
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._t0) * 1000
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "reason": self.reason,
+            "status_code": self.status_code,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "samples": self.samples,
+            "spans": len(self.spans),
+        }
+
+    def as_dict(self) -> Dict[str, Any]:
+        data = self.summary()
+        data["spans"] = self.spans
+        return data
+
+    def collapsed_stacks(self) -> str:
+        # Formato "marco;marco;marco cuenta" que aceptan flamegraph.pl y speedscope.
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, trace: RequestTrace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start_ms = self.trace.elapsed_ms()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.trace.spans.append({
+            "name": self.name,
+            "start_ms": round(self.start_ms, 3),
+            "duration_ms": round(self.trace.elapsed_ms() - self.start_ms, 3),
+            "error": repr(exc) if exc is not None else None,
+        })
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+def span(name: str):
+    # Sin traza activa devuelve un singleton no-op: el costo es un ContextVar.get().
+    trace = _current_trace.get()
+    if trace is None:
+        return _NULL_SPAN
+    return _Span(trace, name)
+
+
+class _StackSampler:
+    # Un solo hilo muestrea sys._current_frames() mientras haya trazas activas.
+    # Como el event loop es compartido, las muestras pueden incluir otras
+    # corrutinas que se ejecutaban en el mismo hilo durante la petición.
+    def __init__(self, interval: float = 0.005, max_depth: int = 128):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._active: Dict[str, RequestTrace] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, trace: RequestTrace):
+        with self._lock:
+            self._active[trace.id] = trace
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+
+    def remove(self, trace: RequestTrace):
+        with self._lock:
+            self._active.pop(trace.id, None)
+
+    def _stack(self, frame) -> str:
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                traces = list(self._active.values())
+            frames = sys._current_frames()
+            for trace in traces:
+                frame = frames.get(trace.thread_id)
+                if frame is not None:
+                    trace.stacks[self._stack(frame)] += 1
+                    trace.samples += 1
+            del frames
+            time.sleep(self.interval)
+
+
+class RequestProfiler:
+    def __init__(self, token: Optional[str] = None, sample_rate: float = 0.0, ring_size: int = 50,
+                 interval: float = 0.005):
+        self.token = token
+        self.sample_rate = sample_rate
+        self.traces: deque = deque(maxlen=ring_size)
+        self.sampler = _StackSampler(interval=interval)
+
+    @classmethod
+    def from_env(cls) -> "RequestProfiler":
+        return cls(
+            token=os.getenv("PROFILE_TOKEN") or None,
+            sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+            ring_size=int(os.getenv("PROFILE_RING_SIZE", "50")),
+            interval=float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token) or self.sample_rate > 0
+
+    def should_profile(self, header_value: Optional[str]) -> Optional[str]:
+        if self.token and header_value and secrets.compare_digest(header_value, self.token):
+            return "header"
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sample"
+        return None
+
+    def get(self, trace_id: str) -> Optional[RequestTrace]:
+        for trace in self.traces:
+            if trace.id == trace_id:
+                return trace
+        return None
+
+
+class ProfilingMiddleware:
+    # Middleware ASGI puro (no BaseHTTPMiddleware) para que el ContextVar de la
+    # traza llegue al endpoint y a los hilos de asyncio.to_thread.
+    def __init__(self, app, profiler: RequestProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        header_value = None
+        if self.profiler.token:
+            for name, value in scope.get("headers", ()):
+                if name == b"x-profile":
+                    header_value = value.decode("latin-1")
+                    break
+        reason = self.profiler.should_profile(header_value)
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace(scope.get("method", ""), scope.get("path", ""), reason, threading.get_ident())
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                trace.status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", trace.id.encode())]
+            await send(message)
+
+        token = _current_trace.set(trace)
+        self.profiler.sampler.add(trace)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.profiler.sampler.remove(trace)
+            _current_trace.reset(token)
+            trace.duration_ms = round(trace.elapsed_ms(), 3)
+            self.profiler.traces.append(trace)
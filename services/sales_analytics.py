@@ -0,0 +1,236 @@
+import asyncio
+import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from firebase_admin import firestore
+
+DAILY_COLLECTION = 'analytics_daily'
+PRODUCTS_COLLECTION = 'analytics_products'
+COMUNAS_COLLECTION = 'analytics_comunas'
+# Una entrada por orden pendiente de sumarse a los contadores.
+OUTBOX_COLLECTION = 'analytics_outbox'
+OUTBOX_BATCH_LIMIT = 200
+FIRESTORE_BATCH_LIMIT = 500
+COUNTER_FIELDS = ('revenue', 'orders', 'units')
+
+SIN_COMUNA = 'sin_comuna'
+
+
+def _doc_key(value: Any) -> str:
+    # Los IDs de documento de Firestore no admiten '/'.
+    key = str(value).strip().replace('/', '_') if value is not None else ''
+    return key or SIN_COMUNA
+
+
+def order_day(order: Dict[str, Any]) -> str:
+    created_at = order.get('createdAt')
+    if isinstance(created_at, datetime.datetime):
+        if created_at.tzinfo is not None:
+            created_at = created_at.astimezone(datetime.timezone.utc)
+        return created_at.date().isoformat()
+    if isinstance(created_at, str) and len(created_at) >= 10:
+        return created_at[:10]
+    return datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+
+
+def order_comuna(order: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    address = (order.get('shipping_info') or {}).get('address') or {}
+    comuna = address.get('comuna') or address.get('countyName') or address.get('comuna_cod')
+    return {"comuna": comuna, "region": address.get('region')}
+
+
+def enqueue_order_for_aggregates(trans, db: firestore.Client, order_id: str, order: Dict[str, Any]):
+    # Solo escribe un documento propio de la orden, por lo que puede llamarse al final
+    # de una transacción después de todas sus lecturas sin competir por los contadores
+    # del día: run_analytics_outbox los acumula después en lotes.
+    address = (order.get('shipping_info') or {}).get('address') or {}
+    trans.set(db.collection(OUTBOX_COLLECTION).document(order_id), {
+        "createdAt": firestore.SERVER_TIMESTAMP,
+        "totalAmount": order.get('totalAmount'),
+        "items": [
+            {"id": item.get('id'), "name": item.get('name'), "price": item.get('price'), "quantity": item.get('quantity')}
+            for item in order.get('items') or []
+        ],
+        "shipping_info": {"address": {
+            key: address.get(key) for key in ('comuna', 'countyName', 'comuna_cod', 'region')
+        }},
+    })
+
+
+def _increments(entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        key: firestore.Increment(value) if key in COUNTER_FIELDS else value
+        for key, value in entry.items()
+    }
+
+
+def _take_within_limit(docs: List[Any]) -> List[Any]:
+    # Cada orden tomada cuesta un delete más un documento por día, producto y comuna
+    # que aún no esté en el lote; se corta antes de superar el límite de escrituras.
+    # Una orden que no cabe sola (o ya a medio aplicar) queda para _drain_oversized.
+    keys = set()
+    taken = []
+    for doc in docs:
+        order = doc.to_dict() or {}
+        if order.get('appliedKeys'):
+            break
+        order_keys = {(DAILY_COLLECTION, order_day(order)), (COMUNAS_COLLECTION, _doc_key(order_comuna(order)["comuna"]))}
+        order_keys.update((PRODUCTS_COLLECTION, _doc_key(item.get('id'))) for item in order.get('items') or [])
+        if len(taken) + 1 + len(keys | order_keys) > FIRESTORE_BATCH_LIMIT:
+            break
+        keys |= order_keys
+        taken.append(doc)
+    return taken
+
+
+def _order_writes(order: Dict[str, Any]) -> List[Tuple[str, str, str, Dict[str, Any]]]:
+    aggregator = SalesAggregator()
+    aggregator.add_batch([order])
+    return sorted(
+        (f"{collection_name}/{doc_id}", collection_name, doc_id, entry)
+        for collection_name, entries in aggregator.collections().items()
+        for doc_id, entry in entries.items()
+    )
+
+
+def _drain_oversized(db: firestore.Client, doc_ref) -> int:
+    # Una orden con más documentos de los que caben en una transacción se reparte en
+    # varias. Cada una registra en appliedKeys los contadores ya sumados junto con los
+    # Increment, así un reintento o un segundo worker no los cuenta dos veces; la
+    # última borra la entrada.
+    @firestore.transactional
+    def _step(trans) -> Optional[bool]:
+        snapshot = doc_ref.get(transaction=trans)
+        if not snapshot.exists:
+            return None
+        order = snapshot.to_dict() or {}
+        applied = set(order.get('appliedKeys') or [])
+        pending = [write for write in _order_writes(order) if write[0] not in applied]
+        chunk = pending[:FIRESTORE_BATCH_LIMIT - 1]
+        for _, collection_name, doc_id, entry in chunk:
+            trans.set(db.collection(collection_name).document(doc_id), _increments(entry), merge=True)
+        if len(chunk) == len(pending):
+            trans.delete(doc_ref)
+            return True
+        trans.update(doc_ref, {'appliedKeys': firestore.ArrayUnion([key for key, *_ in chunk])})
+        return False
+
+    while True:
+        done = _step(db.transaction())
+        if done is not False:
+            return 1 if done else 0
+
+
+def drain_outbox(db: firestore.Client, batch_limit: int = OUTBOX_BATCH_LIMIT) -> int:
+    query = db.collection(OUTBOX_COLLECTION).limit(batch_limit)
+
+    # Leer y borrar las entradas en la misma transacción que suma los contadores evita
+    # contar dos veces una orden si otro worker procesa el mismo lote.
+    @firestore.transactional
+    def _run(trans):
+        pending = list(trans.get(query))
+        docs = _take_within_limit(pending)
+        if not docs:
+            # La primera entrada no cabe sola en un lote: se procesa aparte para que la
+            # cola no quede detenida detrás de ella.
+            return 0, (pending[0].reference if pending else None)
+        aggregator = SalesAggregator()
+        aggregator.add_batch([doc.to_dict() or {} for doc in docs])
+        for collection_name, entries in aggregator.collections().items():
+            for doc_id, entry in entries.items():
+                trans.set(db.collection(collection_name).document(doc_id), _increments(entry), merge=True)
+        for doc in docs:
+            trans.delete(doc.reference)
+        return len(docs), None
+
+    drained, oversized = _run(db.transaction())
+    if oversized is not None:
+        return _drain_oversized(db, oversized)
+    return drained
+
+
+async def run_analytics_outbox(db: firestore.Client, interval_seconds: float = 10):
+    while True:
+        try:
+            while await asyncio.to_thread(drain_outbox, db):
+                pass
+        except Exception as e:
+            print(f"Error al acumular las analíticas de ventas: {e}")
+        await asyncio.sleep(interval_seconds)
+
+
+class SalesAggregator:
+    def __init__(self):
+        self.daily: Dict[str, Dict[str, Any]] = {}
+        self.products: Dict[str, Dict[str, Any]] = {}
+        self.comunas: Dict[str, Dict[str, Any]] = {}
+        self.orders_seen = 0
+
+    def add_batch(self, orders: List[Dict[str, Any]]):
+        if not orders:
+            return
+        self.orders_seen += len(orders)
+
+        days = np.array([order_day(o) for o in orders])
+        revenue = np.array([float(o.get('totalAmount') or 0) for o in orders], dtype=np.float64)
+        order_units = np.array(
+            [sum(int(i.get('quantity') or 0) for i in (o.get('items') or [])) for o in orders],
+            dtype=np.int64,
+        )
+        day_keys, day_idx = np.unique(days, return_inverse=True)
+        day_revenue = np.bincount(day_idx, weights=revenue, minlength=len(day_keys))
+        day_orders = np.bincount(day_idx, minlength=len(day_keys))
+        day_units = np.bincount(day_idx, weights=order_units, minlength=len(day_keys))
+        for k, day in enumerate(day_keys.tolist()):
+            entry = self.daily.setdefault(day, {"date": day, "revenue": 0.0, "orders": 0, "units": 0})
+            entry["revenue"] += float(day_revenue[k])
+            entry["orders"] += int(day_orders[k])
+            entry["units"] += int(day_units[k])
+
+        locations = [order_comuna(o) for o in orders]
+        comuna_ids = np.array([_doc_key(loc["comuna"]) for loc in locations])
+        comuna_keys, first_seen, comuna_idx = np.unique(comuna_ids, return_index=True, return_inverse=True)
+        comuna_revenue = np.bincount(comuna_idx, weights=revenue, minlength=len(comuna_keys))
+        comuna_orders = np.bincount(comuna_idx, minlength=len(comuna_keys))
+        for k, key in enumerate(comuna_keys.tolist()):
+            location = locations[first_seen[k]]
+            entry = self.comunas.setdefault(key, {
+                "comuna": location["comuna"], "region": location["region"], "orders": 0, "revenue": 0.0,
+            })
+            entry["revenue"] += float(comuna_revenue[k])
+            entry["orders"] += int(comuna_orders[k])
+
+        items = [item for o in orders for item in (o.get('items') or [])]
+        if not items:
+            return
+        product_ids = np.array([_doc_key(i.get('id')) for i in items])
+        quantities = np.array([int(i.get('quantity') or 0) for i in items], dtype=np.int64)
+        prices = np.array([float(i.get('price') or 0) for i in items], dtype=np.float64)
+        product_keys, first_item, product_idx = np.unique(product_ids, return_index=True, return_inverse=True)
+        product_units = np.bincount(product_idx, weights=quantities, minlength=len(product_keys))
+        product_revenue = np.bincount(product_idx, weights=quantities * prices, minlength=len(product_keys))
+        for k, key in enumerate(product_keys.tolist()):
+            item = items[first_item[k]]
+            entry = self.products.setdefault(key, {
+                "productId": item.get('id'), "name": item.get('name'), "units": 0, "revenue": 0.0,
+            })
+            entry["units"] += int(product_units[k])
+            entry["revenue"] += float(product_revenue[k])
+
+    def add_stream(self, orders: Iterable[Dict[str, Any]], batch_size: int = 5000):
+        batch = []
+        for order in orders:
+            batch.append(order)
+            if len(batch) >= batch_size:
+                self.add_batch(batch)
+                batch = []
+        self.add_batch(batch)
+        return self
+
+    def collections(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        return {
+            DAILY_COLLECTION: self.daily,
+            PRODUCTS_COLLECTION: self.products,
+            COMUNAS_COLLECTION: self.comunas,
+        }
@@ -0,0 +1,188 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_MISSING = object()
+
+
+class SharedCacheBackend(ABC):
+    @abstractmethod
+    def get(self, key: str) -> Any:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: float):
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+
+class MemoryCacheBackend(SharedCacheBackend):
+    # Solo para un proceso (tests o desarrollo con un único worker).
+    def __init__(self):
+        self._data: Dict[str, tuple] = {}
+
+    def get(self, key: str) -> Any:
+        entry = self._data.get(key)
+        if entry is None or entry[1] < time.time():
+            return _MISSING
+        return entry[0]
+
+    def set(self, key: str, value: Any, ttl: float):
+        self._data[key] = (value, time.time() + ttl)
+
+    def delete(self, key: str):
+        self._data.pop(key, None)
+
+
+class SqliteCacheBackend(SharedCacheBackend):
+    # Almacén clave-valor local compartido por todos los workers del nodo. Por defecto
+    # vive en /dev/shm, así que en la práctica es memoria compartida con WAL.
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Any:
+        row = self._connection().execute(
+            "SELECT value FROM cache WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else _MISSING
+
+    def set(self, key: str, value: Any, ttl: float):
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, default=str), time.time() + ttl),
+        )
+        if random.random() < 0.01:
+            conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+
+    def delete(self, key: str):
+        self._connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+
+class SharedCache:
+    # get_or_load hace single-flight en dos niveles: un Future por clave dentro del
+    # worker y un flock por clave entre procesos, así solo un worker por nodo
+    # refresca cada entrada mientras el resto espera el valor en el backend.
+    def __init__(self, backend: SharedCacheBackend, lock_dir: Optional[str] = None,
+                 lock_timeout: float = 10.0, poll_interval: float = 0.05):
+        self.backend = backend
+        self.lock_dir = lock_dir
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self._inflight: Dict[str, asyncio.Future] = {}
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    async def get(self, key: str) -> Any:
+        value = await asyncio.to_thread(self.backend.get, key)
+        return None if value is _MISSING else value
+
+    async def set(self, key: str, value: Any, ttl: float):
+        await asyncio.to_thread(self.backend.set, key, value, ttl)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self.backend.delete, key)
+
+    async def get_or_load(self, key: str, ttl: float, loader: Callable[[], Awaitable[Any]]) -> Any:
+        value = await asyncio.to_thread(self.backend.get, key)
+        if value is not _MISSING:
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await self._load_across_processes(key, ttl, loader)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Evita el aviso de excepción no recuperada cuando nadie más esperaba.
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _load_across_processes(self, key: str, ttl: float, loader) -> Any:
+        if fcntl is None or not self.lock_dir:
+            value = await loader()
+            await self.set(key, value, ttl)
+            return value
+
+        lock_path = os.path.join(self.lock_dir, hashlib.sha1(key.encode()).hexdigest() + ".lock")
+        fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            deadline = time.monotonic() + self.lock_timeout
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    # Otro worker está refrescando: esperamos a que publique el valor.
+                    await asyncio.sleep(self.poll_interval)
+                    value = await asyncio.to_thread(self.backend.get, key)
+                    if value is not _MISSING:
+                        return value
+                    if time.monotonic() >= deadline:
+                        print(f"Advertencia: timeout esperando el lock de caché para '{key}', se carga sin lock.")
+                        value = await loader()
+                        await self.set(key, value, ttl)
+                        return value
+            try:
+                value = await asyncio.to_thread(self.backend.get, key)
+                if value is not _MISSING:
+                    return value
+                value = await loader()
+                await self.set(key, value, ttl)
+                return value
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+
+def create_shared_cache() -> SharedCache:
+    backend_name = os.getenv("SHARED_CACHE_BACKEND", "sqlite").lower()
+    base_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    if backend_name == "memory":
+        return SharedCache(MemoryCacheBackend())
+    if backend_name == "sqlite":
+        path = os.getenv("SHARED_CACHE_PATH", os.path.join(base_dir, "ecommerce-cache.sqlite"))
+        lock_dir = os.getenv("SHARED_CACHE_LOCK_DIR", os.path.join(base_dir, "ecommerce-cache-locks"))
+        return SharedCache(SqliteCacheBackend(path), lock_dir=lock_dir)
+    raise ValueError(f"SHARED_CACHE_BACKEND no soportado: {backend_name}")
@@ -0,0 +1,164 @@
+import base64
+import binascii
+import copy
+import hashlib
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional, Tuple
+
+from services.product_images import sniff_media_type
+
+LABEL_REF_LENGTH = 32
+
+
+def label_ref_for(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:LABEL_REF_LENGTH]
+
+
+def _check_ref(label_ref: str) -> str:
+    if len(label_ref) != LABEL_REF_LENGTH or not all(c in "0123456789abcdef" for c in label_ref):
+        raise ValueError(f"Referencia de etiqueta inválida: {label_ref}")
+    return label_ref
+
+
+class LabelBlobStore(ABC):
+    # durable indica si el almacén sobrevive al nodo y lo comparten todos los nodos.
+    durable = False
+
+    @abstractmethod
+    def put(self, data: bytes) -> str:
+        ...
+
+    @abstractmethod
+    def get(self, label_ref: str) -> Optional[bytes]:
+        ...
+
+    @abstractmethod
+    def delete(self, label_ref: str):
+        ...
+
+
+class LocalLabelBlobStore(LabelBlobStore):
+    # Los nombres son el hash del contenido: volver a subir la misma etiqueta (por
+    # ejemplo, al repetir la migración) no duplica archivos ni cambia la referencia.
+    def __init__(self, base_dir: str):
+        self.base_dir = base_dir
+        os.makedirs(base_dir, exist_ok=True)
+
+    def _path(self, label_ref: str) -> str:
+        _check_ref(label_ref)
+        return os.path.join(self.base_dir, label_ref[:2], label_ref)
+
+    def put(self, data: bytes) -> str:
+        label_ref = label_ref_for(data)
+        path = self._path(label_ref)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return label_ref
+
+    def get(self, label_ref: str) -> Optional[bytes]:
+        try:
+            with open(self._path(label_ref), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, label_ref: str):
+        try:
+            os.remove(self._path(label_ref))
+        except FileNotFoundError:
+            pass
+
+
+class CloudStorageLabelBlobStore(LabelBlobStore):
+    # Almacén compartido por todos los nodos, en el bucket de Firebase Storage del proyecto.
+    durable = True
+
+    def __init__(self, bucket_name: Optional[str] = None, prefix: str = "shipping-labels/"):
+        from firebase_admin import storage
+        self.bucket = storage.bucket(bucket_name)
+        self.prefix = prefix
+
+    def _blob(self, label_ref: str):
+        return self.bucket.blob(self.prefix + _check_ref(label_ref))
+
+    def put(self, data: bytes) -> str:
+        label_ref = label_ref_for(data)
+        blob = self._blob(label_ref)
+        if not blob.exists():
+            blob.upload_from_string(data, content_type=label_media_type(data))
+        return label_ref
+
+    def get(self, label_ref: str) -> Optional[bytes]:
+        from google.cloud.exceptions import NotFound
+        try:
+            return self._blob(label_ref).download_as_bytes()
+        except NotFound:
+            return None
+
+    def delete(self, label_ref: str):
+        from google.cloud.exceptions import NotFound
+        try:
+            self._blob(label_ref).delete()
+        except NotFound:
+            pass
+
+
+def create_label_store() -> LabelBlobStore:
+    # Configuración por variables de entorno:
+    #   LABEL_STORE_BUCKET   bucket de Cloud Storage; es lo que corresponde en producción.
+    #   LABEL_STORE_BACKEND  "gcs" o "local"; por defecto "gcs" si hay bucket, si no "local".
+    #   LABEL_STORE_DIR      directorio del backend local (idealmente un disco compartido).
+    # Sin bucket ni directorio se usa un directorio temporal con una advertencia: sirve
+    # para desarrollo, pero las etiquetas se pierden al reiniciar y no se comparten entre nodos.
+    bucket = os.getenv("LABEL_STORE_BUCKET")
+    backend_name = os.getenv("LABEL_STORE_BACKEND", "gcs" if bucket else "local").lower()
+    if backend_name == "gcs":
+        return CloudStorageLabelBlobStore(bucket)
+    if backend_name == "local":
+        base_dir = os.getenv("LABEL_STORE_DIR")
+        if not base_dir:
+            base_dir = os.path.join(tempfile.gettempdir(), "shipping-labels")
+            print(f"Advertencia: LABEL_STORE_BUCKET y LABEL_STORE_DIR no están definidos; las etiquetas "
+                  f"se guardan en {base_dir}, que no es persistente ni se comparte entre nodos.")
+        return LocalLabelBlobStore(base_dir)
+    raise ValueError(f"LABEL_STORE_BACKEND no soportado: {backend_name}")
+
+
+def label_media_type(data: bytes) -> str:
+    # labelType 1 es una imagen; el resto son comandos EPL/ZPL en texto plano.
+    media_type = sniff_media_type(data[:12])
+    return "text/plain" if media_type == "application/octet-stream" else media_type
+
+
+def decode_label(label_data: str) -> Tuple[bytes, str]:
+    try:
+        data = base64.b64decode(label_data, validate=True)
+    except (binascii.Error, ValueError):
+        data = label_data.encode("utf-8")
+    return data, label_media_type(data)
+
+
+def offload_labels(chilexpress_response: Optional[Dict[str, Any]], store: LabelBlobStore) -> Tuple[Optional[Dict[str, Any]], int]:
+    # Devuelve una copia de la respuesta con labelData reemplazado por labelRef y la
+    # cantidad de etiquetas movidas al almacén.
+    if not chilexpress_response:
+        return chilexpress_response, 0
+    details = (chilexpress_response.get("data") or {}).get("detail")
+    if not isinstance(details, list):
+        return chilexpress_response, 0
+
+    response = copy.deepcopy(chilexpress_response)
+    moved = 0
+    for detail in response["data"]["detail"]:
+        if not isinstance(detail, dict) or not detail.get("labelData"):
+            continue
+        data, _ = decode_label(detail.pop("labelData"))
+        detail["labelRef"] = store.put(data)
+        moved += 1
+    return response, moved
@@ -0,0 +1,211 @@
+import asyncio
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from firebase_admin import firestore
+
+from services.chilexpress_api import ChilexpressApiService
+
+QUOTE_SAMPLES_COLLECTION = 'shipping_quote_samples'
+VOLUMETRIC_DIVISOR = 4000.0
+QUOTE_BUDGET_SECONDS = float(os.getenv("SHIPPING_QUOTE_BUDGET_MS", "800")) / 1000
+RATE_TABLE_REFRESH_SECONDS = float(os.getenv("SHIPPING_RATE_REFRESH_SECONDS", "900"))
+
+
+def _float(value: Any, default: float = 0.0) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def billable_weight(package: Dict[str, Any]) -> float:
+    # Chilexpress cobra por el mayor entre el peso real y el volumétrico (cm³ / 4000).
+    weight = _float(package.get("weight"))
+    volume = _float(package.get("height")) * _float(package.get("width")) * _float(package.get("length"))
+    return max(weight, volume / VOLUMETRIC_DIVISOR)
+
+
+def samples_from_quote(quote_body: Dict[str, Any], response: Dict[str, Any]) -> List[Dict[str, Any]]:
+    origin = quote_body.get("originCountyCode")
+    destination = quote_body.get("destinationCountyCode")
+    if not origin or not destination:
+        return []
+    request_weight = billable_weight(quote_body.get("package") or {})
+    samples = []
+    for option in ((response or {}).get("data") or {}).get("courierServiceOptions") or []:
+        price = _float(option.get("serviceValue"), None)
+        if price is None or option.get("serviceTypeCode") is None:
+            continue
+        samples.append({
+            "origin": str(origin),
+            "destination": str(destination),
+            "serviceTypeCode": int(option["serviceTypeCode"]),
+            "serviceDescription": option.get("serviceDescription"),
+            "deliveryType": option.get("deliveryType"),
+            "weight": _float(option.get("finalWeight"), request_weight) or request_weight,
+            "price": price,
+        })
+    return samples
+
+
+class RateTable:
+    # Una tabla por (origen, destino): pesos ordenados y una matriz de precios con una
+    # fila por servicio, así una consulta interpola todos los servicios con una sola
+    # llamada vectorizada. Fuera del rango conocido se extrapola con la pendiente del
+    # tramo más cercano: las tarifas son un cargo fijo más un valor por kilo.
+    def __init__(self):
+        self._lanes: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.samples = 0
+
+    def __len__(self) -> int:
+        return len(self._lanes)
+
+    @classmethod
+    def build(cls, samples: Iterable[Dict[str, Any]]) -> "RateTable":
+        grouped: Dict[Tuple[str, str], Dict[int, Dict[float, float]]] = {}
+        meta: Dict[Tuple[str, str, int], Dict[str, Any]] = {}
+        table = cls()
+        for sample in samples:
+            lane = (sample["origin"], sample["destination"])
+            service = int(sample["serviceTypeCode"])
+            grouped.setdefault(lane, {}).setdefault(service, {})[float(sample["weight"])] = float(sample["price"])
+            entry = meta.setdefault(lane + (service,), {"serviceDescription": None, "deliveryType": None})
+            for field in entry:
+                if sample.get(field) is not None:
+                    entry[field] = sample[field]
+            table.samples += 1
+
+        for lane, services in grouped.items():
+            codes = sorted(services)
+            weights = np.array(sorted({w for points in services.values() for w in points}), dtype=np.float64)
+            prices = np.empty((len(codes), len(weights)), dtype=np.float64)
+            for row, code in enumerate(codes):
+                # Cada servicio puede tener pesos distintos: se completan sobre la grilla común.
+                points = services[code]
+                known_w = np.array(sorted(points), dtype=np.float64)
+                known_p = np.array([points[w] for w in known_w], dtype=np.float64)
+                prices[row] = cls._interp(weights, known_w, known_p[None, :])[0]
+            # Una tarifa nunca baja con el peso; así la extrapolación tampoco puede bajar.
+            prices = np.maximum.accumulate(prices, axis=1)
+            table._lanes[lane] = {
+                "codes": np.array(codes, dtype=np.int64),
+                "weights": weights,
+                "prices": prices,
+                "meta": [meta[lane + (code,)] for code in codes],
+            }
+        return table
+
+    @staticmethod
+    def _interp(x: np.ndarray, weights: np.ndarray, prices: np.ndarray) -> np.ndarray:
+        # prices: (servicios, pesos) -> (servicios, len(x))
+        x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+        if len(weights) == 1:
+            return np.repeat(prices[:, :1], len(x), axis=1)
+        idx = np.clip(np.searchsorted(weights, x, side="right") - 1, 0, len(weights) - 2)
+        w0, w1 = weights[idx], weights[idx + 1]
+        t = (x - w0) / (w1 - w0)
+        return np.maximum(prices[:, idx] + (prices[:, idx + 1] - prices[:, idx]) * t, 0.0)
+
+    def estimate_prices(self, origin: str, destination: str, weights) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        lane = self._lanes.get((str(origin), str(destination)))
+        if lane is None:
+            return None
+        return lane["codes"], self._interp(weights, lane["weights"], lane["prices"])
+
+    def estimate(self, quote_body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        lane = self._lanes.get((str(quote_body.get("originCountyCode")), str(quote_body.get("destinationCountyCode"))))
+        if lane is None:
+            return None
+        weight = billable_weight(quote_body.get("package") or {})
+        prices = self._interp(weight, lane["weights"], lane["prices"])[:, 0]
+        options = []
+        for code, price, meta in zip(lane["codes"], prices, lane["meta"]):
+            options.append({
+                "serviceTypeCode": int(code),
+                "serviceDescription": meta.get("serviceDescription"),
+                "deliveryType": meta.get("deliveryType"),
+                "finalWeight": f"{weight:g}",
+                "serviceValue": str(int(round(price))),
+                "didUseVolumetricWeight": weight > _float((quote_body.get("package") or {}).get("weight")),
+                "additionalServices": [],
+                "estimated": True,
+            })
+        options.sort(key=lambda option: int(option["serviceValue"]))
+        return {"data": {"courierServiceOptions": options}, "estimated": True}
+
+
+class ShippingQuoter:
+    # Cotiza contra Chilexpress con un presupuesto de latencia. Si la llamada real no
+    # responde a tiempo o falla, se contesta con la tabla local marcada como estimación;
+    # la llamada real sigue en segundo plano y su resultado alimenta la tabla.
+    def __init__(self, service: ChilexpressApiService, db: Optional[firestore.Client] = None,
+                 budget_seconds: float = QUOTE_BUDGET_SECONDS):
+        self.service = service
+        self.db = db
+        self.budget_seconds = budget_seconds
+        self.table = RateTable()
+        self._background: set = set()
+
+    def _record(self, samples: List[Dict[str, Any]]):
+        if self.db is None or not samples:
+            return
+        # Un documento por punto (carril, servicio, peso): la colección no crece con el
+        # tráfico y cada cotización real reemplaza al precio anterior.
+        batch = self.db.batch()
+        for sample in samples:
+            doc_id = f"{sample['origin']}:{sample['destination']}:{sample['serviceTypeCode']}:{sample['weight']:g}"
+            batch.set(self.db.collection(QUOTE_SAMPLES_COLLECTION).document(doc_id),
+                      {**sample, "updatedAt": firestore.SERVER_TIMESTAMP})
+        batch.commit()
+
+    async def _live(self, quote_body: Dict[str, Any]) -> Dict[str, Any]:
+        response = await self.service.quote_shipping(quote_body=dict(quote_body))
+        try:
+            await asyncio.to_thread(self._record, samples_from_quote(quote_body, response))
+        except Exception as e:
+            print(f"Advertencia: no se pudo registrar la cotización: {e}")
+        return response
+
+    async def quote(self, quote_body: Dict[str, Any]) -> Dict[str, Any]:
+        task = asyncio.create_task(self._live(quote_body))
+        try:
+            response = await asyncio.wait_for(asyncio.shield(task), self.budget_seconds)
+        except asyncio.TimeoutError:
+            estimate = self.table.estimate(quote_body)
+            if estimate is None:
+                # Carril sin datos: no hay alternativa a esperar la respuesta real.
+                response = await task
+            else:
+                self._background.add(task)
+                task.add_done_callback(self._background.discard)
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                return estimate
+        except Exception:
+            estimate = self.table.estimate(quote_body)
+            if estimate is None:
+                raise
+            return estimate
+        if isinstance(response, dict):
+            response = {**response, "estimated": False}
+        return response
+
+    def _load_samples(self) -> List[Dict[str, Any]]:
+        return [doc.to_dict() for doc in self.db.collection(QUOTE_SAMPLES_COLLECTION).stream()]
+
+    async def rebuild(self) -> RateTable:
+        samples = await asyncio.to_thread(self._load_samples)
+        self.table = await asyncio.to_thread(RateTable.build, samples)
+        return self.table
+
+    async def keep_updated(self, interval_seconds: float = RATE_TABLE_REFRESH_SECONDS):
+        if self.db is None:
+            return
+        while True:
+            try:
+                table = await self.rebuild()
+                print(f"Tabla de tarifas reconstruida: {len(table)} carriles, {table.samples} muestras")
+            except Exception as e:
+                print(f"Error al reconstruir la tabla de tarifas: {e}")
+            await asyncio.sleep(interval_seconds)
@@ -0,0 +1,393 @@
+import asyncio
+import datetime
+import os
+import random
+import socket
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from firebase_admin import firestore
+from google.api_core.exceptions import Conflict
+
+from services.profiling import span
+
+if TYPE_CHECKING:
+    from repositories.products import ProductRepository
+
+RESERVATIONS_COLLECTION = 'stock_reservations'
+SHARDS_SUBCOLLECTION = 'stock_shards'
+# Total de los productos con shards, fuera del documento del producto que leen las compras.
+ROLLUPS_COLLECTION = 'stock_rollups'
+RESERVATION_TTL_SECONDS = int(os.getenv("STOCK_RESERVATION_TTL_SECONDS", "900"))
+# Lease para que un solo worker recalcule stock_rollups por intervalo.
+LEASES_COLLECTION = 'worker_leases'
+ROLLUP_LEASE_ID = 'stock_rollup'
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+HELD = 'held'
+# Pago autorizado en Transbank pero la orden aún no se crea: el barrido no la expira.
+PAID = 'paid'
+CONFIRMED = 'confirmed'
+EXPIRED = 'expired'
+RELEASED = 'released'
+
+# stockBackend de las reservas cuyo stock movió el repositorio (catálogo fuera de
+# Firestore): al liberarlas el stock se devuelve con repository.restore_stock.
+REPOSITORY_STOCK = 'repository'
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _shard_ref(db: firestore.Client, product_id: str, shard: int, collection: str = 'products'):
+    return db.collection(collection).document(product_id).collection(SHARDS_SUBCOLLECTION).document(str(shard))
+
+
+def plan_decrement(trans, db: firestore.Client, product_id: str, quantity: int, product_name: Optional[str] = None,
+                   collection: str = 'products') -> Tuple[List[Tuple[Any, Dict[str, Any]]], List[Dict[str, Any]]]:
+    # Solo hace lecturas dentro de la transacción y devuelve (escrituras, asignaciones)
+    # para aplicarlas después de leer todo el carrito. Los productos con stockShards
+    # reparten el stock en N documentos y la reserva empieza en un shard aleatorio,
+    # así las compras concurrentes de un mismo SKU tocan documentos distintos.
+    product_ref = db.collection(collection).document(product_id)
+    snapshot = product_ref.get(transaction=trans)
+    if not snapshot.exists:
+        raise ValueError(f"Producto {product_id} no encontrado.")
+    product = snapshot.to_dict()
+    label = product_name or product.get('name') or product_id
+    shards = int(product.get('stockShards') or 0)
+
+    if shards <= 0:
+        current_stock = product.get('stock', 0)
+        if current_stock < quantity:
+            raise ValueError(f"Stock insuficiente para {label}.")
+        return [(product_ref, {'stock': current_stock - quantity})], [{"productId": product_id, "shard": None, "quantity": quantity}]
+
+    writes, allocations = [], []
+    remaining = quantity
+    start = random.randrange(shards)
+    for offset in range(shards):
+        shard = (start + offset) % shards
+        shard_ref = _shard_ref(db, product_id, shard, collection)
+        shard_snapshot = shard_ref.get(transaction=trans)
+        available = shard_snapshot.to_dict().get('stock', 0) if shard_snapshot.exists else 0
+        if available <= 0:
+            continue
+        taken = min(available, remaining)
+        writes.append((shard_ref, {'stock': available - taken}))
+        allocations.append({"productId": product_id, "shard": shard, "quantity": taken})
+        remaining -= taken
+        if remaining == 0:
+            return writes, allocations
+    raise ValueError(f"Stock insuficiente para {label}.")
+
+
+def read_held_reservation(trans, db: firestore.Client, buy_order: str) -> Optional[Dict[str, Any]]:
+    snapshot = db.collection(RESERVATIONS_COLLECTION).document(buy_order).get(transaction=trans)
+    if not snapshot.exists:
+        return None
+    reservation = snapshot.to_dict()
+    if reservation.get('status') not in (HELD, PAID):
+        return None
+    return reservation
+
+
+def reserved_quantities(reservation: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    quantities: Dict[str, int] = {}
+    for allocation in (reservation or {}).get('allocations', []):
+        quantities[allocation['productId']] = quantities.get(allocation['productId'], 0) + allocation['quantity']
+    return quantities
+
+
+def _allocation_ref(db: firestore.Client, allocation: Dict[str, Any]):
+    if allocation.get('shard') is None:
+        return db.collection('products').document(allocation['productId'])
+    return _shard_ref(db, allocation['productId'], allocation['shard'])
+
+
+def plan_surplus_release(db: firestore.Client, reservation: Optional[Dict[str, Any]],
+                         quantities: Dict[str, int]) -> List[Tuple[Any, Dict[str, Any]]]:
+    # Lo retenido que la orden final ya no usa vuelve a su producto o shard. Solo son
+    # Increment, así que no necesita lecturas dentro de la transacción.
+    surplus = {
+        product_id: reserved - quantities.get(product_id, 0)
+        for product_id, reserved in reserved_quantities(reservation).items()
+        if reserved > quantities.get(product_id, 0)
+    }
+    writes = []
+    for allocation in (reservation or {}).get('allocations', []):
+        remaining = surplus.get(allocation['productId'], 0)
+        returned = min(remaining, allocation['quantity'])
+        if returned <= 0:
+            continue
+        writes.append((_allocation_ref(db, allocation), {'stock': firestore.Increment(returned)}))
+        surplus[allocation['productId']] = remaining - returned
+    return writes
+
+
+def merge_quantities(items: List[Dict[str, Any]]) -> Dict[str, int]:
+    quantities: Dict[str, int] = {}
+    for item in items:
+        quantities[item['id']] = quantities.get(item['id'], 0) + int(item['quantity'])
+    return quantities
+
+
+def split_against_reservation(quantities: Dict[str, int],
+                              reservation: Optional[Dict[str, Any]]) -> Tuple[Dict[str, int], Dict[str, int]]:
+    # (lo que falta descontar, lo retenido de más) por producto.
+    reserved = reserved_quantities(reservation)
+    shortfall = {pid: q - reserved.get(pid, 0) for pid, q in quantities.items() if q > reserved.get(pid, 0)}
+    surplus = {pid: r - quantities.get(pid, 0) for pid, r in reserved.items() if r > quantities.get(pid, 0)}
+    return shortfall, surplus
+
+
+def mark_confirmed(trans, db: firestore.Client, buy_order: str, order_id: str):
+    trans.update(db.collection(RESERVATIONS_COLLECTION).document(buy_order), {
+        'status': CONFIRMED,
+        'orderId': order_id,
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+    })
+
+
+def _reserve(db: firestore.Client, buy_order: str, items: List[Dict[str, Any]], ttl_seconds: int) -> Dict[str, Any]:
+    reservation_ref = db.collection(RESERVATIONS_COLLECTION).document(buy_order)
+
+    @firestore.transactional
+    def _run(trans):
+        existing = reservation_ref.get(transaction=trans)
+        if existing.exists and existing.to_dict().get('status') in (HELD, PAID):
+            return existing.to_dict()
+
+        quantities = merge_quantities(items)
+
+        writes, allocations = [], []
+        for product_id, quantity in quantities.items():
+            item_writes, item_allocations = plan_decrement(trans, db, product_id, quantity)
+            writes.extend(item_writes)
+            allocations.extend(item_allocations)
+        for ref, data in writes:
+            trans.update(ref, data)
+
+        reservation = {
+            'buyOrder': buy_order,
+            'status': HELD,
+            'allocations': allocations,
+            'expiresAt': _now() + datetime.timedelta(seconds=ttl_seconds),
+            'createdAt': firestore.SERVER_TIMESTAMP,
+        }
+        trans.set(reservation_ref, reservation)
+        return reservation
+
+    return _run(db.transaction())
+
+
+def _create_reservation(db: firestore.Client, buy_order: str, quantities: Dict[str, int],
+                        ttl_seconds: int) -> Optional[Dict[str, Any]]:
+    reservation = {
+        'buyOrder': buy_order,
+        'status': HELD,
+        'stockBackend': REPOSITORY_STOCK,
+        'allocations': [{"productId": pid, "shard": None, "quantity": q} for pid, q in quantities.items()],
+        'expiresAt': _now() + datetime.timedelta(seconds=ttl_seconds),
+        'createdAt': firestore.SERVER_TIMESTAMP,
+    }
+    try:
+        # create() falla si otro request ya registró la reserva de esta orden.
+        db.collection(RESERVATIONS_COLLECTION).document(buy_order).create(reservation)
+    except Conflict:
+        return None
+    return reservation
+
+
+def _release(db: firestore.Client, buy_order: str, status: str) -> Tuple[bool, Dict[str, int]]:
+    # Devuelve (liberada, stock a devolver con el repositorio).
+    reservation_ref = db.collection(RESERVATIONS_COLLECTION).document(buy_order)
+
+    @firestore.transactional
+    def _run(trans):
+        snapshot = reservation_ref.get(transaction=trans)
+        if not snapshot.exists or snapshot.to_dict().get('status') != HELD:
+            return False, {}
+        reservation = snapshot.to_dict()
+        trans.update(reservation_ref, {'status': status, 'updatedAt': firestore.SERVER_TIMESTAMP})
+        if reservation.get('stockBackend') == REPOSITORY_STOCK:
+            return True, reserved_quantities(reservation)
+        # Devolver stock no necesita leer los shards: Increment evita más contención.
+        for allocation in reservation.get('allocations', []):
+            trans.update(_allocation_ref(db, allocation), {'stock': firestore.Increment(allocation['quantity'])})
+        return True, {}
+
+    return _run(db.transaction())
+
+
+async def _restore_external(repository: Optional["ProductRepository"], buy_order: str, quantities: Dict[str, int]):
+    if not quantities:
+        return
+    if repository is None:
+        print(f"Advertencia: la reserva {buy_order} se liberó sin repositorio; su stock no se devolvió: {quantities}")
+        return
+    # El estado ya cambió: si esto falla el stock queda retenido y se informa para
+    # corregirlo a mano, nunca se devuelve dos veces.
+    try:
+        await repository.restore_stock(quantities)
+    except Exception as e:
+        print(f"Error al devolver el stock de la reserva {buy_order}: {e} ({quantities})")
+
+
+def _mark_paid(db: firestore.Client, buy_order: str) -> bool:
+    reservation_ref = db.collection(RESERVATIONS_COLLECTION).document(buy_order)
+
+    @firestore.transactional
+    def _run(trans):
+        snapshot = reservation_ref.get(transaction=trans)
+        if not snapshot.exists or snapshot.to_dict().get('status') != HELD:
+            return False
+        trans.update(reservation_ref, {'status': PAID, 'updatedAt': firestore.SERVER_TIMESTAMP})
+        return True
+
+    return _run(db.transaction())
+
+
+async def reserve_stock(db: firestore.Client, buy_order: str, items: List[Dict[str, Any]],
+                        ttl_seconds: int = RESERVATION_TTL_SECONDS,
+                        repository: Optional["ProductRepository"] = None) -> Dict[str, Any]:
+    if repository is None or repository.firestore_stock:
+        async with span("firestore stock_reservations.reserve"):
+            return await asyncio.to_thread(_reserve, db, buy_order, items, ttl_seconds)
+
+    # Catálogo fuera de Firestore: el repositorio descuenta todo el carrito de una vez
+    # y Firestore solo guarda el registro de la reserva.
+    reservation_ref = db.collection(RESERVATIONS_COLLECTION).document(buy_order)
+    existing = await asyncio.to_thread(reservation_ref.get)
+    if existing.exists and existing.to_dict().get('status') in (HELD, PAID):
+        return existing.to_dict()
+    quantities = merge_quantities(items)
+    await repository.decrement_stock(quantities)
+    try:
+        async with span("firestore stock_reservations.reserve"):
+            reservation = await asyncio.to_thread(_create_reservation, db, buy_order, quantities, ttl_seconds)
+    except Exception:
+        await repository.restore_stock(quantities)
+        raise
+    if reservation is None:
+        await repository.restore_stock(quantities)
+        return (await asyncio.to_thread(reservation_ref.get)).to_dict()
+    return reservation
+
+
+async def release_reservation(db: firestore.Client, buy_order: str, status: str = RELEASED,
+                              repository: Optional["ProductRepository"] = None) -> bool:
+    async with span("firestore stock_reservations.release"):
+        released, external = await asyncio.to_thread(_release, db, buy_order, status)
+    await _restore_external(repository, buy_order, external)
+    return released
+
+
+async def mark_reservation_paid(db: firestore.Client, buy_order: str) -> bool:
+    async with span("firestore stock_reservations.paid"):
+        return await asyncio.to_thread(_mark_paid, db, buy_order)
+
+
+def _claim_rollup_lease(db: firestore.Client, lease_seconds: float) -> bool:
+    # Igual que TbkReconciler._claim: quien tiene el lease lo renueva en cada vuelta y
+    # los demás workers solo lo toman cuando vence (p. ej. si ese proceso murió).
+    ref = db.collection(LEASES_COLLECTION).document(ROLLUP_LEASE_ID)
+
+    @firestore.transactional
+    def _run(trans):
+        snapshot = ref.get(transaction=trans)
+        record = (snapshot.to_dict() or {}) if snapshot.exists else {}
+        claimed_until = record.get('claimedUntil')
+        if record.get('claimedBy') != WORKER_ID and claimed_until is not None and claimed_until > _now():
+            return False
+        trans.set(ref, {
+            'claimedBy': WORKER_ID,
+            'claimedUntil': _now() + datetime.timedelta(seconds=lease_seconds),
+        })
+        return True
+
+    return _run(db.transaction())
+
+
+def _rollup_sharded_stock(db: firestore.Client):
+    # El total va a stock_rollups y no al documento del producto: escribir ahí haría
+    # fallar las transacciones de compra que lo leen en plan_decrement.
+    rollups = {doc.id: (doc.to_dict() or {}).get('stock') for doc in db.collection(ROLLUPS_COLLECTION).stream()}
+    for product in db.collection('products').where('stockShards', '>', 0).stream():
+        shards = db.collection('products').document(product.id).collection(SHARDS_SUBCOLLECTION).stream()
+        total = sum((shard.to_dict() or {}).get('stock', 0) for shard in shards)
+        if total != rollups.get(product.id):
+            db.collection(ROLLUPS_COLLECTION).document(product.id).set({
+                'stock': total,
+                'updatedAt': firestore.SERVER_TIMESTAMP,
+            })
+
+
+def _expire_due(db: firestore.Client, limit: int) -> List[Tuple[str, Dict[str, int]]]:
+    due = (
+        db.collection(RESERVATIONS_COLLECTION)
+        .where('status', '==', HELD)
+        .where('expiresAt', '<=', _now())
+        .limit(limit)
+        .stream()
+    )
+    expired = []
+    for snapshot in due:
+        released, external = _release(db, snapshot.id, EXPIRED)
+        if released:
+            expired.append((snapshot.id, external))
+    return expired
+
+
+async def run_reservation_sweeper(db: firestore.Client, repository: Optional["ProductRepository"] = None,
+                                  interval_seconds: float = 30, batch_limit: int = 200):
+    while True:
+        try:
+            expired = await asyncio.to_thread(_expire_due, db, batch_limit)
+            for buy_order, external in expired:
+                await _restore_external(repository, buy_order, external)
+            if expired:
+                print(f"Reservas de stock expiradas: {len(expired)}")
+            if repository is None or repository.firestore_stock:
+                # El lease dura dos vueltas: si este worker cae, otro lo retoma pronto.
+                if await asyncio.to_thread(_claim_rollup_lease, db, 2 * interval_seconds):
+                    await asyncio.to_thread(_rollup_sharded_stock, db)
+        except Exception as e:
+            print(f"Error en el barrido de reservas de stock: {e}")
+        await asyncio.sleep(interval_seconds)
+
+
+def enable_sharding(db: firestore.Client, product_id: str, shards: int) -> Dict[str, Any]:
+    product_ref = db.collection('products').document(product_id)
+
+    @firestore.transactional
+    def _run(trans):
+        snapshot = product_ref.get(transaction=trans)
+        if not snapshot.exists:
+            raise ValueError(f"Producto {product_id} no encontrado.")
+        product = snapshot.to_dict()
+        current_shards = int(product.get('stockShards') or 0)
+        if current_shards:
+            shard_snapshots = [_shard_ref(db, product_id, k).get(transaction=trans) for k in range(current_shards)]
+            total = sum(s.to_dict().get('stock', 0) for s in shard_snapshots if s.exists)
+        else:
+            total = product.get('stock', 0)
+
+        # shards=0 vuelve a dejar todo el stock en el documento del producto.
+        if shards > 0:
+            base, extra = divmod(total, shards)
+            for k in range(shards):
+                trans.set(_shard_ref(db, product_id, k), {'stock': base + (1 if k < extra else 0)})
+        for k in range(shards, current_shards):
+            trans.delete(_shard_ref(db, product_id, k))
+        trans.update(product_ref, {'stockShards': shards, 'stock': total})
+        if shards > 0:
+            trans.set(db.collection(ROLLUPS_COLLECTION).document(product_id), {
+                'stock': total,
+                'updatedAt': firestore.SERVER_TIMESTAMP,
+            })
+        else:
+            trans.delete(db.collection(ROLLUPS_COLLECTION).document(product_id))
+        return {"productId": product_id, "shards": shards, "stock": total}
+
+    return _run(db.transaction())
@@ -0,0 +1,245 @@
+import asyncio
+import datetime
+import json
+import os
+import random
+import socket
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+from firebase_admin import firestore
+
+from init_transaction import commit_tbk_transaction, status_tbk_transaction
+from services.profiling import span
+from services.shared_cache import SharedCache
+from services.stock_reservations import EXPIRED, RELEASED, mark_reservation_paid, release_reservation
+
+TRANSACTIONS_COLLECTION = 'tbk_transactions'
+
+PENDING = 'pending'
+AUTHORIZED = 'authorized'
+REJECTED = 'rejected'
+EXPIRED_TX = 'expired'
+RESOLVED_STATUSES = (AUTHORIZED, REJECTED, EXPIRED_TX)
+
+# Estados de Webpay Plus que ya no pueden terminar en un pago.
+TBK_FINAL_FAILURES = ('FAILED', 'REVERSED', 'NULLIFIED')
+
+RESULT_CACHE_TTL = 3600
+CLAIM_SECONDS = 120
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _plain(data: Dict[str, Any]) -> Dict[str, Any]:
+    # Las respuestas del SDK pueden traer objetos; Firestore y la caché necesitan JSON.
+    return json.loads(json.dumps(data, default=str))
+
+
+def _entry(record: Dict[str, Any]) -> Dict[str, Any]:
+    return {"status": record.get('status'), "result": record.get('result'), "committed": bool(record.get('committed'))}
+
+
+def _committed_result(entry: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if entry is not None and entry.get("committed") and entry.get("result") is not None:
+        return entry["result"]
+    return None
+
+
+class TbkReconciler:
+    # Registra cada token creado en /api/init-tx y, en segundo plano, consulta su
+    # estado en Transbank para confirmar (commit) pagos cuyo navegador nunca volvió y
+    # expirar los abandonados. Cuando el usuario vuelve, confirm() suele ser solo una
+    # lectura. Solo un resultado obtenido con commit cuenta como pago: status no
+    # confirma la transacción en Webpay Plus.
+    #
+    # Todos los workers ejecutan run(), pero cada token se reclama con una transacción
+    # (claimedBy/claimedUntil) antes de consultarlo, así solo un worker llama a Transbank.
+    def __init__(self, db: firestore.Client, cache: Optional[SharedCache] = None,
+                 grace_seconds: int = None, expiry_seconds: int = None,
+                 concurrency: int = None, batch_size: int = 100, repository=None):
+        self.db = db
+        self.cache = cache
+        # Catálogo dueño del stock: las reservas liberadas le devuelven lo retenido.
+        self.repository = repository
+        self.grace_seconds = grace_seconds or int(os.getenv("TBK_RECONCILE_GRACE_SECONDS", "120"))
+        self.expiry_seconds = expiry_seconds or int(os.getenv("TBK_TOKEN_EXPIRY_SECONDS", "900"))
+        self.concurrency = concurrency or int(os.getenv("TBK_RECONCILE_CONCURRENCY", "8"))
+        self.batch_size = batch_size
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    def _ref(self, token: str):
+        return self.db.collection(TRANSACTIONS_COLLECTION).document(token)
+
+    async def record_created(self, token: str, buy_order: str, session_id: str, amount: Any):
+        async with span("firestore tbk_transactions.create"):
+            await asyncio.to_thread(self._ref(token).set, {
+                "token": token,
+                "buyOrder": buy_order,
+                "sessionId": session_id,
+                "amount": amount,
+                "status": PENDING,
+                "createdAt": _now(),
+            })
+
+    async def _store_result(self, token: str, status: str, result: Optional[Dict[str, Any]],
+                            committed: bool = False, **extra):
+        data = {"status": status, "result": _plain(result) if result is not None else None,
+                "committed": committed, "claimedBy": None, "claimedUntil": None,
+                "updatedAt": firestore.SERVER_TIMESTAMP, **extra}
+        async with span("firestore tbk_transactions.update"):
+            await asyncio.to_thread(self._ref(token).set, data, merge=True)
+        if self.cache is not None:
+            await self.cache.set(f"tbk:{token}", _entry(data), RESULT_CACHE_TTL)
+
+    async def lookup(self, token: str) -> Optional[Dict[str, Any]]:
+        if self.cache is not None:
+            cached = await self.cache.get(f"tbk:{token}")
+            if cached is not None:
+                return cached
+        async with span("firestore tbk_transactions.get"):
+            snapshot = await asyncio.to_thread(self._ref(token).get)
+        if not snapshot.exists:
+            return None
+        entry = _entry(snapshot.to_dict())
+        if self.cache is not None and entry["status"] in RESOLVED_STATUSES:
+            await self.cache.set(f"tbk:{token}", entry, RESULT_CACHE_TTL)
+        return entry
+
+    async def _commit(self, token: str, buy_order: Optional[str], **extra) -> Dict[str, Any]:
+        try:
+            result = await commit_tbk_transaction(token)
+        except HTTPException:
+            # Si otro worker (o el navegador) hizo commit primero, Transbank rechaza el
+            # segundo: devolvemos lo ya registrado.
+            stored = _committed_result(await self.lookup(token))
+            if stored is not None:
+                return stored
+            raise
+
+        authorized = result.get('response_code') == 0
+        # buyOrder también queda registrado aunque record_created haya fallado: la creación
+        # de la orden busca el pago por ese campo.
+        if result.get('buy_order') or buy_order:
+            extra.setdefault('buyOrder', result.get('buy_order') or buy_order)
+        await self._store_result(token, AUTHORIZED if authorized else REJECTED, result, committed=True, **extra)
+        if buy_order:
+            if authorized:
+                # El stock reservado ya está pagado: el barrido de reservas no debe devolverlo.
+                await mark_reservation_paid(self.db, buy_order)
+            else:
+                await release_reservation(self.db, buy_order, RELEASED, repository=self.repository)
+        return result
+
+    async def _buy_order(self, token: str) -> Optional[str]:
+        snapshot = await asyncio.to_thread(self._ref(token).get)
+        return snapshot.to_dict().get('buyOrder') if snapshot.exists else None
+
+    async def confirm(self, token: str) -> Dict[str, Any]:
+        stored = _committed_result(await self.lookup(token))
+        if stored is not None:
+            return stored
+        return await self._commit(token, await self._buy_order(token))
+
+    def _payments_for(self, buy_order: str):
+        query = self.db.collection(TRANSACTIONS_COLLECTION).where('buyOrder', '==', buy_order).limit(10)
+        return [doc.to_dict() for doc in query.stream()]
+
+    async def committed_payment(self, buy_order: str) -> Optional[Dict[str, Any]]:
+        # Resultado del commit autorizado de una orden de compra, leído del registro del
+        # servidor: lo que envía el navegador no sirve como prueba de pago.
+        async with span("firestore tbk_transactions.by_buy_order"):
+            records = await asyncio.to_thread(self._payments_for, buy_order)
+        for record in records:
+            if record.get('status') == AUTHORIZED and record.get('committed') and record.get('result'):
+                return record['result']
+        return None
+
+    def _claim(self, token: str) -> bool:
+        ref = self._ref(token)
+
+        @firestore.transactional
+        def _run(trans):
+            snapshot = ref.get(transaction=trans)
+            if not snapshot.exists:
+                return False
+            record = snapshot.to_dict()
+            claimed_until = record.get('claimedUntil')
+            if record.get('status') != PENDING or (claimed_until is not None and claimed_until > _now()):
+                return False
+            trans.update(ref, {
+                'claimedBy': self.worker_id,
+                'claimedUntil': _now() + datetime.timedelta(seconds=CLAIM_SECONDS),
+            })
+            return True
+
+        return _run(self.db.transaction())
+
+    async def _reconcile_one(self, record: Dict[str, Any]):
+        token = record['token']
+        if not await asyncio.to_thread(self._claim, token):
+            return
+        created_at = record.get('createdAt')
+        age = (_now() - created_at).total_seconds() if isinstance(created_at, datetime.datetime) else self.expiry_seconds
+
+        try:
+            status = await status_tbk_transaction(token)
+        except Exception as e:
+            if age >= self.expiry_seconds:
+                await self._expire(record, f"status no disponible: {e}")
+            return
+
+        tbk_status = status.get('status')
+        if tbk_status == 'AUTHORIZED' and status.get('response_code') == 0:
+            # status no confirma el pago: sin commit Transbank lo reversa.
+            await self._commit(token, record.get('buyOrder'), resolvedBy="reconciler")
+        elif tbk_status in TBK_FINAL_FAILURES:
+            await self._store_result(token, REJECTED, status, resolvedBy="reconciler")
+            if record.get('buyOrder'):
+                await release_reservation(self.db, record['buyOrder'], EXPIRED, repository=self.repository)
+        elif tbk_status == 'INITIALIZED' and age >= self.expiry_seconds:
+            await self._expire(record, "token expirado sin pago")
+
+    async def _expire(self, record: Dict[str, Any], reason: str):
+        await self._store_result(record['token'], EXPIRED_TX, None, resolvedBy="reconciler", reason=reason)
+        if record.get('buyOrder'):
+            await release_reservation(self.db, record['buyOrder'], EXPIRED, repository=self.repository)
+
+    def _due_records(self):
+        cutoff = _now() - datetime.timedelta(seconds=self.grace_seconds)
+        query = (
+            self.db.collection(TRANSACTIONS_COLLECTION)
+            .where('status', '==', PENDING)
+            .where('createdAt', '<=', cutoff)
+            .order_by('createdAt')
+            .limit(self.batch_size)
+        )
+        return [doc.to_dict() for doc in query.stream()]
+
+    async def reconcile_once(self) -> int:
+        records = await asyncio.to_thread(self._due_records)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def _bounded(record):
+            async with semaphore:
+                try:
+                    await self._reconcile_one(record)
+                except Exception as e:
+                    print(f"Error al reconciliar el token {record.get('token')}: {e}")
+
+        await asyncio.gather(*(_bounded(record) for record in records))
+        return len(records)
+
+    async def run(self, interval_seconds: float = None):
+        interval_seconds = interval_seconds or float(os.getenv("TBK_RECONCILE_INTERVAL_SECONDS", "60"))
+        while True:
+            try:
+                processed = await self.reconcile_once()
+                if processed:
+                    print(f"Transacciones Transbank reconciliadas: {processed}")
+            except Exception as e:
+                print(f"Error en el reconciliador de Transbank: {e}")
+            # El desfase evita que todos los workers consulten Firestore al mismo tiempo.
+            await asyncio.sleep(interval_seconds * random.uniform(0.8, 1.2))
@@ -0,0 +1,59 @@
+import argparse
+import hashlib
+import sys
+
+# Uso:
+#   python -m tools.backfill_image_hashes --dry-run
+#   python -m tools.backfill_image_hashes
+
+FIRESTORE_BATCH_LIMIT = 500
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Completa imagenHash en los productos con imagen propia.")
+    parser.add_argument('--dry-run', action='store_true', help="Solo cuenta los productos afectados")
+    parser.add_argument('--page-size', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    from tools.firebase_client import get_db
+    db = get_db()
+
+    scanned = updated = 0
+    batch = db.batch()
+    pending = 0
+    last = None
+    # El catálogo ya no descarga 'imagen': sin imagenHash el producto queda sin imageUrl.
+    # Se pagina solo con imagenHash y se lee la imagen únicamente de los que no lo tienen.
+    while True:
+        query = db.collection('products').select(['imagenHash']).order_by('__name__').limit(args.page_size)
+        if last is not None:
+            query = query.start_after(last)
+        docs = list(query.stream())
+        if not docs:
+            break
+        last = docs[-1]
+        for doc in docs:
+            scanned += 1
+            if (doc.to_dict() or {}).get('imagenHash'):
+                continue
+            image = (doc.reference.get(field_paths=['imagen']).to_dict() or {}).get('imagen')
+            if not image:
+                continue
+            updated += 1
+            if not args.dry_run:
+                batch.update(doc.reference, {'imagenHash': hashlib.sha256(bytes(image)).hexdigest()})
+                pending += 1
+                if pending >= FIRESTORE_BATCH_LIMIT:
+                    batch.commit()
+                    batch = db.batch()
+                    pending = 0
+    if pending:
+        batch.commit()
+
+    action = "se actualizarían" if args.dry_run else "actualizados"
+    print(f"Productos revisados: {scanned}; productos {action}: {updated}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+import argparse
+import asyncio
+import json
+import sys
+
+from services.bulk_catalog import SUPPORTED_FORMATS, aiter_sync, export_products, import_products, seed_orders
+from tools.firebase_client import get_db
+
+# Uso:
+#   python -m tools.bulk_catalog import products.csv --format csv
+#   python -m tools.bulk_catalog export --format ndjson > products.ndjson
+#   python -m tools.bulk_catalog seed-orders --count 20000
+
+
+async def _run_import(db, path: str, fmt: str, dry_run: bool, max_in_flight: int, quiet: bool) -> int:
+    handle = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8', newline='')
+    summary = {}
+    try:
+        async for report in import_products(db, aiter_sync(handle), fmt=fmt, dry_run=dry_run, max_in_flight=max_in_flight):
+            if report["type"] == "summary":
+                summary = report
+            elif not quiet or not report.get("ok", True):
+                print(json.dumps(report, ensure_ascii=False))
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+    print(json.dumps(summary, ensure_ascii=False), file=sys.stderr)
+    return 1 if summary.get("invalid") or summary.get("failed") else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Importación/exportación masiva del catálogo.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="Importa productos desde CSV o NDJSON")
+    import_parser.add_argument("path", help="Archivo de entrada ('-' para stdin)")
+    import_parser.add_argument("--format", choices=SUPPORTED_FORMATS, default="ndjson")
+    import_parser.add_argument("--dry-run", action="store_true")
+    import_parser.add_argument("--max-in-flight", type=int, default=4)
+    import_parser.add_argument("--quiet", action="store_true", help="Solo muestra errores")
+
+    export_parser = subparsers.add_parser("export", help="Exporta productos a stdout")
+    export_parser.add_argument("--format", choices=SUPPORTED_FORMATS, default="ndjson")
+
+    seed_parser = subparsers.add_parser("seed-orders", help="Genera órdenes sintéticas para pruebas de carga")
+    seed_parser.add_argument("--count", type=int, default=1000)
+    seed_parser.add_argument("--max-in-flight", type=int, default=4)
+
+    args = parser.parse_args(argv)
+    db = get_db()
+
+    if args.command == "import":
+        return asyncio.run(_run_import(db, args.path, args.format, args.dry_run, args.max_in_flight, args.quiet))
+    if args.command == "export":
+        for line in export_products(db, fmt=args.format):
+            sys.stdout.write(line)
+        return 0
+    result = asyncio.run(seed_orders(db, args.count, max_in_flight=args.max_in_flight))
+    print(json.dumps(result, ensure_ascii=False))
+    return 1 if result["errors"] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,23 @@
+import os
+import firebase_admin
+from dotenv import load_dotenv
+from firebase_admin import credentials, initialize_app, firestore
+
+load_dotenv()
+
+SERVICE_ACCOUNT_KEY_PATH = os.getenv("FIREBASE_SERVICE_ACCOUNT_PATH", "../../mi-app-carrito/config/serviceAccountKey.json")
+
+
+def get_db() -> firestore.Client:
+    if os.getenv("FIRESTORE_EMULATOR_HOST"):
+        # Contra el emulador local no se necesitan credenciales reales.
+        from google.cloud import firestore as gcloud_firestore
+        return gcloud_firestore.Client(project=os.getenv("GOOGLE_CLOUD_PROJECT", "demo-ecommerce"))
+
+    if not os.path.exists(SERVICE_ACCOUNT_KEY_PATH):
+        raise FileNotFoundError(
+            f"ERROR: El archivo de clave de servicio de Firebase NO se encontró en: {SERVICE_ACCOUNT_KEY_PATH}"
+        )
+    if not firebase_admin._apps:
+        initialize_app(credentials.Certificate(SERVICE_ACCOUNT_KEY_PATH))
+    return firestore.client()
@@ -0,0 +1,101 @@
+import argparse
+import json
+import math
+import sys
+from typing import Any, Dict, Iterator
+
+from services.sales_analytics import SalesAggregator
+
+# Uso:
+#   python -m tools.recompute_analytics --input orders.ndjson --verify
+#   python -m tools.recompute_analytics --from-firestore --write
+
+FIRESTORE_BATCH_LIMIT = 500
+
+
+def _read_ndjson(path: str) -> Iterator[Dict[str, Any]]:
+    handle = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+    try:
+        for line_number, line in enumerate(handle, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Advertencia: línea {line_number} inválida, se omite: {e}", file=sys.stderr)
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+
+def _stream_firestore_orders(db) -> Iterator[Dict[str, Any]]:
+    for doc in db.collection('orders').stream():
+        yield doc.to_dict()
+
+
+def _write_counters(db, aggregator: SalesAggregator):
+    batch = db.batch()
+    pending = 0
+    for collection_name, entries in aggregator.collections().items():
+        for doc_id, data in entries.items():
+            batch.set(db.collection(collection_name).document(doc_id), data)
+            pending += 1
+            if pending >= FIRESTORE_BATCH_LIMIT:
+                batch.commit()
+                batch = db.batch()
+                pending = 0
+    if pending:
+        batch.commit()
+
+
+def _verify_counters(db, aggregator: SalesAggregator) -> int:
+    mismatches = 0
+    for collection_name, entries in aggregator.collections().items():
+        stored = {doc.id: doc.to_dict() for doc in db.collection(collection_name).stream()}
+        for doc_id in sorted(set(entries) | set(stored)):
+            expected = entries.get(doc_id, {})
+            actual = stored.get(doc_id, {})
+            for field in ('revenue', 'orders', 'units'):
+                if field not in expected and field not in actual:
+                    continue
+                if not math.isclose(float(expected.get(field, 0)), float(actual.get(field, 0)), abs_tol=0.01):
+                    mismatches += 1
+                    print(f"{collection_name}/{doc_id}.{field}: esperado={expected.get(field, 0)} almacenado={actual.get(field, 0)}")
+    return mismatches
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Recalcula los contadores de ventas a partir de las órdenes.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input', help="Exportación NDJSON de órdenes ('-' para stdin)")
+    source.add_argument('--from-firestore', action='store_true', help="Lee las órdenes directamente de Firestore")
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--write', action='store_true', help="Sobrescribe los contadores almacenados")
+    parser.add_argument('--verify', action='store_true', help="Compara con los contadores almacenados")
+    args = parser.parse_args(argv)
+
+    db = None
+    if args.from_firestore or args.write or args.verify:
+        from tools.firebase_client import get_db
+        db = get_db()
+
+    orders = _stream_firestore_orders(db) if args.from_firestore else _read_ndjson(args.input)
+    aggregator = SalesAggregator().add_stream(orders, batch_size=args.batch_size)
+    print(f"Órdenes procesadas: {aggregator.orders_seen}")
+
+    if args.verify:
+        mismatches = _verify_counters(db, aggregator)
+        print(f"Diferencias encontradas: {mismatches}")
+        if mismatches and not args.write:
+            return 1
+    if args.write:
+        _write_counters(db, aggregator)
+        print("Contadores reescritos.")
+    if not (args.write or args.verify):
+        print(json.dumps(aggregator.collections(), indent=2, ensure_ascii=False, default=str))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
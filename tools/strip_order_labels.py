@@ -0,0 +1,82 @@
+import argparse
+import os
+import sys
+
+from services.shipping_labels import create_label_store, offload_labels
+
+# Uso:
+#   python -m tools.strip_order_labels --dry-run
+#   python -m tools.strip_order_labels
+
+FIRESTORE_BATCH_LIMIT = 500
+DETAIL_FIELD = 'shipping.chilexpressResponse.data.detail'
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Mueve labelData de las órdenes existentes al almacén de etiquetas.")
+    parser.add_argument('--dry-run', action='store_true', help="Solo cuenta las órdenes afectadas")
+    parser.add_argument('--page-size', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    store = create_label_store()
+    if not store.durable and not args.dry_run:
+        # Esta herramienta borra labelData de Firestore: la copia debe quedar en un almacén
+        # que lean todos los nodos y que no se limpie solo.
+        if not os.getenv("LABEL_STORE_DIR"):
+            print("Error: el almacén local de etiquetas no es persistente. Configura LABEL_STORE_BUCKET "
+                  "o un LABEL_STORE_DIR compartido antes de migrar.", file=sys.stderr)
+            return 2
+        print(f"Advertencia: se migra a un directorio local ({os.getenv('LABEL_STORE_DIR')}); "
+              "debe ser un volumen compartido por todos los nodos.", file=sys.stderr)
+
+    from tools.firebase_client import get_db
+    db = get_db()
+
+    scanned = updated = labels = 0
+    batch = db.batch()
+    pending = 0
+    last = None
+    # Se pagina por id de documento para no mantener un stream abierto mientras se escribe.
+    while True:
+        query = db.collection('orders').order_by('__name__').limit(args.page_size)
+        if last is not None:
+            query = query.start_after(last)
+        docs = list(query.stream())
+        if not docs:
+            break
+        last = docs[-1]
+        for doc in docs:
+            scanned += 1
+            response = ((doc.to_dict().get('shipping') or {}).get('chilexpressResponse'))
+            if args.dry_run:
+                details = ((response or {}).get('data') or {}).get('detail') or []
+                moved = sum(1 for d in details if isinstance(d, dict) and d.get('labelData'))
+            else:
+                # La etiqueta se guarda antes de quitarla de la orden: un corte a mitad
+                # de camino deja, como mucho, un blob huérfano.
+                response, moved = offload_labels(response, store)
+                # Se relee cada blob antes de quitar labelData de la orden.
+                for detail in (response or {}).get('data', {}).get('detail') or []:
+                    if isinstance(detail, dict) and detail.get('labelRef') and store.get(detail['labelRef']) is None:
+                        raise RuntimeError(f"La etiqueta {detail['labelRef']} no quedó en el almacén; se aborta.")
+            if not moved:
+                continue
+            updated += 1
+            labels += moved
+            if not args.dry_run:
+                batch.update(doc.reference, {DETAIL_FIELD: response['data']['detail']})
+                pending += 1
+                if pending >= FIRESTORE_BATCH_LIMIT:
+                    batch.commit()
+                    batch = db.batch()
+                    pending = 0
+    if pending:
+        batch.commit()
+
+    action = "se migrarían" if args.dry_run else "migradas"
+    print(f"Órdenes revisadas: {scanned}; órdenes {action}: {updated}; etiquetas: {labels}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())